@@ -1,18 +1,89 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional
 import asyncio
+import math
+import os
 
 from models.models import (
     Document,
     DocumentChunk,
+    DocumentChunkMetadata,
     DocumentMetadataFilter,
     Query,
     QueryResult,
     QueryWithEmbedding,
 )
-from services.chunks import get_document_chunks
+from services.chunks import (
+    create_document_chunks,
+    embed_document_chunks,
+    get_document_chunks,
+)
+from services.date import to_unix_timestamp
 from services.openai import get_embeddings
 
+# Initial oversampling of top_k for the queries filtered by _query_with_post_filter
+POST_FILTER_OVERSAMPLING = float(os.environ.get("POST_FILTER_OVERSAMPLING", 4))
+# Upper bound of the number of results requested from the provider for a filtered query
+POST_FILTER_MAX_TOP_K = int(os.environ.get("POST_FILTER_MAX_TOP_K", 1000))
+
+# created_at dates repeat across the chunks of a document and across queries
+_cached_unix_timestamp = lru_cache(maxsize=65536)(to_unix_timestamp)
+
+
+def get_search_width(
+    default: float, recall: Optional[float], minimum: int, maximum: float
+) -> int:
+    """
+    Maps a target recall to the width of an approximate vector search, such as its number of
+    candidates or probes. The default width is used for a recall of 0.9 or no recall, and the
+    search is 10x wider for each 10x fewer misses, within the minimum and maximum.
+    """
+    scale = 1.0
+    if recall is not None:
+        scale = 0.1 / (1 - recall) if recall < 1 else math.inf
+    width = min(default * scale, maximum)
+    # rounded first so the float error of the scale doesn't add one
+    return max(math.ceil(round(width, 6)), minimum)
+
+
+def _compile_metadata_filter(
+    filter: Optional[DocumentMetadataFilter],
+) -> Optional[Callable[[DocumentChunkMetadata], bool]]:
+    """
+    Returns a predicate matching chunk metadata against the filter, or None if the filter is empty.
+    The date bounds are converted to timestamps once, rather than for every result.
+    """
+    if filter is None:
+        return None
+    equals = {
+        field: value
+        for field, value in filter.dict(
+            include={"document_id", "source", "source_id", "author"}
+        ).items()
+        if value is not None
+    }
+    start = to_unix_timestamp(filter.start_date) if filter.start_date else None
+    end = to_unix_timestamp(filter.end_date) if filter.end_date else None
+    if not equals and start is None and end is None:
+        return None
+
+    def matches(metadata: DocumentChunkMetadata) -> bool:
+        for field, value in equals.items():
+            if getattr(metadata, field) != value:
+                return False
+        if start is not None or end is not None:
+            if metadata.created_at is None:
+                return False
+            created_at = _cached_unix_timestamp(metadata.created_at)
+            if start is not None and created_at < start:
+                return False
+            if end is not None and created_at > end:
+                return False
+        return True
+
+    return matches
+
 
 class DataStore(ABC):
     async def upsert(
@@ -21,8 +92,19 @@ class DataStore(ABC):
         """
         Takes in a list of documents and inserts them into the database.
         First deletes all the existing vectors with the document id (if necessary, depends on the vector db), then inserts the new ones.
+        If the datastore returns the content hashes of the stored chunks, only the new and changed chunks are embedded and written,
+        and the chunks that are gone are deleted.
         Return a list of document ids.
         """
+        document_ids = [document.id for document in documents if document.id]
+        stored_hashes = (
+            await self._get_chunk_hashes(document_ids) if document_ids else None
+        )
+        if stored_hashes is not None:
+            return await self._upsert_changed_chunks(
+                documents, chunk_token_size, stored_hashes
+            )
+
         # Delete any existing vectors for documents with the input document ids
         await asyncio.gather(
             *[
@@ -41,6 +123,63 @@ class DataStore(ABC):
 
         return await self._upsert(chunks)
 
+    async def _upsert_changed_chunks(
+        self,
+        documents: List[Document],
+        chunk_token_size: Optional[int],
+        stored_hashes: Dict[str, Dict[str, Optional[str]]],
+    ) -> List[str]:
+        """
+        Embeds and inserts the chunks of the documents whose content hash differs from the stored one,
+        then deletes the stored chunks the documents no longer have.
+        Return a list of document ids.
+        """
+        document_ids: List[str] = []
+        changed_chunks: Dict[str, List[DocumentChunk]] = {}
+        stale_chunk_ids: Dict[str, List[str]] = {}
+        for document in documents:
+            document_chunks, document_id = create_document_chunks(
+                document, chunk_token_size
+            )
+            document_ids.append(document_id)
+            stored = stored_hashes.get(document_id, {})
+            chunk_ids = {chunk.id for chunk in document_chunks}
+            stale = [chunk_id for chunk_id in stored if chunk_id not in chunk_ids]
+            if stale:
+                stale_chunk_ids[document_id] = stale
+            changed = [
+                chunk
+                for chunk in document_chunks
+                if stored.get(chunk.id) != chunk.content_hash  # type: ignore
+            ]
+            if changed:
+                changed_chunks[document_id] = changed
+
+        if changed_chunks:
+            embed_document_chunks(
+                [chunk for changed in changed_chunks.values() for chunk in changed]
+            )
+            await self._upsert(changed_chunks)
+        if stale_chunk_ids:
+            await self._delete_chunks(stale_chunk_ids)
+        return document_ids
+
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Optional[str]]]]:
+        """
+        Returns the content hash of each stored chunk by chunk id, for each of the documents,
+        or None if the datastore can't return them, in which case the documents are always rewritten.
+        """
+        return None
+
+    async def _delete_chunks(self, chunk_ids: Dict[str, List[str]]) -> None:
+        """
+        Takes in a dict of document ids to the ids of their chunks and removes those chunks.
+        Required by the datastores implementing _get_chunk_hashes.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
@@ -71,6 +210,74 @@ class DataStore(ABC):
         """
         raise NotImplementedError
 
+    async def _query_with_post_filter(
+        self,
+        queries: List[QueryWithEmbedding],
+        query_unfiltered: Callable[
+            [List[QueryWithEmbedding]], Awaitable[List[QueryResult]]
+        ],
+    ) -> List[QueryResult]:
+        """
+        Runs the queries with query_unfiltered, which ignores the filters, and filters the results.
+        Meant for the providers that can't filter natively.
+        Filtered queries request an oversampled top_k, which is raised from the observed share of
+        matching results until top_k results match, the provider runs out of results, or
+        POST_FILTER_MAX_TOP_K is reached, in which case fewer than top_k results are returned.
+        """
+        matchers = [_compile_metadata_filter(query.filter) for query in queries]
+        results: List[Optional[QueryResult]] = [None] * len(queries)
+        # index of each query still to run, to the top_k requested from the provider
+        requested: Dict[int, int] = {}
+        for i, query in enumerate(queries):
+            top_k = query.top_k or 0
+            if matchers[i] is not None:
+                top_k = min(
+                    max(math.ceil(top_k * POST_FILTER_OVERSAMPLING), top_k),
+                    POST_FILTER_MAX_TOP_K,
+                )
+            requested[i] = top_k
+
+        while requested:
+            indexes = list(requested)
+            provider_results = await query_unfiltered(
+                [
+                    queries[i].copy(update={"filter": None, "top_k": requested[i]})
+                    for i in indexes
+                ]
+            )
+            next_requested: Dict[int, int] = {}
+            for i, provider_result in zip(indexes, provider_results):
+                query, matches_filter = queries[i], matchers[i]
+                if matches_filter is None:
+                    results[i] = provider_result
+                    continue
+                top_k = query.top_k or 0
+                matches = [
+                    result
+                    for result in provider_result.results
+                    if matches_filter(result.metadata)
+                ]
+                exhausted = len(provider_result.results) < requested[i]
+                if (
+                    len(matches) >= top_k
+                    or exhausted
+                    or requested[i] >= POST_FILTER_MAX_TOP_K
+                ):
+                    results[i] = QueryResult(query=query.query, results=matches[:top_k])
+                    continue
+                # estimate the selectivity of the filter from the results so far,
+                # and at least double the request so that sparse matches converge quickly
+                estimate = 0
+                if matches:
+                    match_rate = len(matches) / len(provider_result.results)
+                    estimate = math.ceil(1.2 * top_k / match_rate)
+                next_requested[i] = min(
+                    max(estimate, 2 * requested[i]), POST_FILTER_MAX_TOP_K
+                )
+            requested = next_requested
+
+        return results  # type: ignore
+
     @abstractmethod
     async def delete(
         self,
@@ -84,3 +291,8 @@ class DataStore(ABC):
         Returns whether the operation was successful.
         """
         raise NotImplementedError
+
+    async def close(self) -> None:
+        """
+        Writes out what the datastore holds in memory, called when the server shuts down.
+        """
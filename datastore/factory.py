@@ -6,6 +6,23 @@ async def get_datastore() -> DataStore:
     datastore = os.environ.get("DATASTORE")
     assert datastore is not None
 
+    # a comma-separated list of providers spreads the documents over one shard per provider
+    names = [name.strip() for name in datastore.split(",")]
+    if len(names) > 1:
+        from datastore.sharded_datastore import ShardedDataStore
+
+        store = ShardedDataStore([await create_datastore(name) for name in names])
+    else:
+        store = await create_datastore(datastore)
+
+    if os.environ.get("WRITE_BEHIND", "false").lower() == "true":
+        from datastore.write_behind_datastore import WriteBehindDataStore
+
+        return await WriteBehindDataStore.init(store)
+    return store
+
+
+async def create_datastore(datastore: str) -> DataStore:
     match datastore:
         case "chroma":
             from datastore.providers.chroma_datastore import ChromaDataStore
@@ -57,7 +74,7 @@ async def get_datastore() -> DataStore:
         case "postgres":
             from datastore.providers.postgres_datastore import PostgresDataStore
 
-            return PostgresDataStore()
+            return await PostgresDataStore.init()
         case "analyticdb":
             from datastore.providers.analyticdb_datastore import AnalyticDBDataStore
 
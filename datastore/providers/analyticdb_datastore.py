@@ -8,8 +8,8 @@ from psycopg2cffi import compat
 
 compat.register()
 import psycopg2
-from psycopg2.extras import DictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 from services.date import to_unix_timestamp
 from datastore.datastore import DataStore
@@ -31,6 +31,9 @@ PG_CONFIG = {
     "port": int(os.environ.get("PG_PORT", "5432")),
 }
 OUTPUT_DIM = int(os.environ.get("EMBEDDING_DIMENSION", 256))
+UPSERT_BATCH_SIZE = int(os.environ.get("PG_UPSERT_BATCH_SIZE", 500))
+# number of batches written at the same time, each on its own pooled connection
+UPSERT_CONCURRENCY = int(os.environ.get("PG_UPSERT_CONCURRENCY", 4))
 
 
 class AnalyticDBDataStore(DataStore):
@@ -42,7 +45,8 @@ class AnalyticDBDataStore(DataStore):
         self.host = config["host"]
         self.port = config["port"]
 
-        self.connection_pool = SimpleConnectionPool(
+        # connections are checked out from executor threads
+        self.connection_pool = ThreadedConnectionPool(
             minconn=1,
             maxconn=100,
             dbname=self.database,
@@ -112,23 +116,37 @@ class AnalyticDBDataStore(DataStore):
         Takes in a dict of document_ids to list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
-        loop = asyncio.get_event_loop()
-        tasks = [
-            loop.run_in_executor(None, self._upsert_chunk, chunk)
-            for document_chunks in chunks.values()
-            for chunk in document_chunks
+        # a statement can't update the same row twice, so keep the last version of each chunk
+        rows = list(
+            {
+                chunk.id: self._get_chunk_row(chunk)
+                for document_chunks in chunks.values()
+                for chunk in document_chunks
+            }.values()
+        )
+        batches = [
+            rows[i : i + UPSERT_BATCH_SIZE]
+            for i in range(0, len(rows), UPSERT_BATCH_SIZE)
         ]
-        await asyncio.gather(*tasks)
+
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
+
+        async def upsert_batch(batch: List[Tuple]):
+            async with semaphore:
+                await loop.run_in_executor(None, self._upsert_batch, batch)
+
+        await asyncio.gather(*[upsert_batch(batch) for batch in batches])
 
         return list(chunks.keys())
 
-    def _upsert_chunk(self, chunk: DocumentChunk):
+    def _get_chunk_row(self, chunk: DocumentChunk) -> Tuple:
         created_at = (
             datetime.fromtimestamp(to_unix_timestamp(chunk.metadata.created_at))
             if chunk.metadata.created_at
             else None
         )
-        data = (
+        return (
             chunk.id,
             chunk.text,
             chunk.embedding,
@@ -140,13 +158,14 @@ class AnalyticDBDataStore(DataStore):
             created_at,
         )
 
+    def _upsert_batch(self, batch: List[Tuple]):
         conn = self.connection_pool.getconn()
         try:
             with conn.cursor() as cur:
-                # Construct the SQL query and data
+                # Construct the SQL query, the rows are expanded by execute_values
                 query = f"""
                         INSERT INTO {self.collection_name} (id, content, embedding, document_id, source, source_id, url, author, created_at)
-                        VALUES (%s::text, %s::text, %s::real[], %s::text, %s::text, %s::text, %s::text, %s::text, %s::timestamp with time zone)
+                        VALUES %s
                         ON CONFLICT (id) DO UPDATE SET
                             content = EXCLUDED.content,
                             embedding = EXCLUDED.embedding,
@@ -158,8 +177,14 @@ class AnalyticDBDataStore(DataStore):
                             created_at = EXCLUDED.created_at;
                 """
 
-                # Execute the query
-                cur.execute(query, data)
+                # Execute the query for the whole batch
+                execute_values(
+                    cur,
+                    query,
+                    batch,
+                    template="(%s::text, %s::text, %s::real[], %s::text, %s::text, %s::text, %s::text, %s::text, %s::timestamp with time zone)",
+                    page_size=len(batch),
+                )
 
                 # Commit the transaction
                 conn.commit()
@@ -170,95 +195,118 @@ class AnalyticDBDataStore(DataStore):
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
-        query_results: List[QueryResult] = []
-
-        def generate_query(query: QueryWithEmbedding) -> Tuple[str, List[Any]]:
-            embedding = "[" + ", ".join(str(x) for x in query.embedding) + "]"
-            q = f"""
-                SELECT
-                    id,
-                    content,
-                    source,
-                    source_id,
-                    document_id,
-                    url,
-                    created_at,
-                    author,
-                    embedding,
-                    l2_distance(embedding,array{embedding}::real[]) AS similarity
-                FROM
-                    {self.collection_name}
-            """
-            where_clause, params = generate_where_clause(query.filter)
-            q += where_clause
-            q += f"ORDER BY embedding <-> array{embedding}::real[] LIMIT {query.top_k};"
-            return q, params
-
-        def generate_where_clause(
-            query_filter: Optional[DocumentMetadataFilter],
-        ) -> Tuple[str, List[Any]]:
-            if query_filter is None:
-                return "", []
-
-            conditions = [
-                ("document_id=%s", query_filter.document_id),
-                ("source_id=%s", query_filter.source_id),
-                ("source LIKE %s", query_filter.source),
-                ("author LIKE %s", query_filter.author),
-                ("created_at >= %s", query_filter.start_date),
-                ("created_at <= %s", query_filter.end_date),
-            ]
-
-            where_clause = "WHERE " + " AND ".join(
-                [cond[0] for cond in conditions if cond[1] is not None]
-            )
-
-            values = [cond[1] for cond in conditions if cond[1] is not None]
-
-            return where_clause, values
-
-        def fetch_data(cur, q: str, params: List[Any]):
-            cur.execute(q, params)
-            return cur.fetchall()
-
-        def create_results(data):
-            results = []
-            for row in data:
-                document_chunk = DocumentChunkWithScore(
-                    id=row["id"],
-                    text=row["content"],
-                    score=float(row["similarity"]),
-                    metadata=DocumentChunkMetadata(
-                        source=row["source"],
-                        source_id=row["source_id"],
-                        document_id=row["document_id"],
-                        url=row["url"],
-                        created_at=str(row["created_at"]),
-                        author=row["author"],
-                    ),
-                )
-                results.append(document_chunk)
-            return results
+        loop = asyncio.get_event_loop()
+        # each query runs on its own pooled connection
+        tasks = [
+            loop.run_in_executor(None, self._query_single, query) for query in queries
+        ]
+        return await asyncio.gather(*tasks)
 
+    def _query_single(self, query: QueryWithEmbedding) -> QueryResult:
         conn = self.connection_pool.getconn()
         try:
-            for query in queries:
-                try:
-                    cur = conn.cursor(cursor_factory=DictCursor)
-                    for query in queries:
-                        q, params = generate_query(query)
-                        data = fetch_data(cur, q, params)
-                        results = create_results(data)
-                        query_results.append(
-                            QueryResult(query=query.query, results=results)
-                        )
-                except Exception as e:
-                    logger.error(e)
-                    query_results.append(QueryResult(query=query.query, results=[]))
-            return query_results
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                data = self._execute_query(cur, query)
+            return QueryResult(query=query.query, results=self._create_results(data))
+        except Exception as e:
+            logger.error(e)
+            return QueryResult(query=query.query, results=[])
         finally:
             self.connection_pool.putconn(conn)
 
+    def _execute_query(self, cur, query: QueryWithEmbedding) -> List[Any]:
+        """
+        Runs the query as a prepared statement, so the embedding is bound as a real[] parameter
+        and the plan is cached per connection for each combination of filters.
+        """
+        conditions = self._generate_query_conditions(query.filter)
+        name = f"{self.collection_name}_query_" + "".join(
+            "1" if value is not None else "0" for _, value in conditions
+        )
+        values = [value for _, value in conditions if value is not None]
+        params = [query.embedding, query.top_k, *values]
+        execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))});"
+        try:
+            cur.execute(execute, params)
+        except psycopg2.Error as e:
+            # invalid_sql_statement_name, the statement isn't prepared on this connection yet
+            if e.pgcode != "26000":
+                raise
+            cur.connection.rollback()
+            cur.execute(self._generate_prepare_statement(name, conditions))
+            cur.execute(execute, params)
+        return cur.fetchall()
+
+    def _generate_query_conditions(
+        self, query_filter: Optional[DocumentMetadataFilter]
+    ) -> List[Tuple[str, Any]]:
+        if query_filter is None:
+            query_filter = DocumentMetadataFilter()
+
+        return [
+            ("document_id = {}", query_filter.document_id),
+            ("source_id = {}", query_filter.source_id),
+            (
+                "source LIKE {}",
+                query_filter.source.value if query_filter.source else None,
+            ),
+            ("author LIKE {}", query_filter.author),
+            ("created_at >= {}::timestamptz", query_filter.start_date),
+            ("created_at <= {}::timestamptz", query_filter.end_date),
+        ]
+
+    def _generate_prepare_statement(
+        self, name: str, conditions: List[Tuple[str, Any]]
+    ) -> str:
+        # $1 is the embedding and $2 the limit, the filter values follow
+        where_conditions = [
+            condition.format(f"${i}")
+            for i, condition in enumerate(
+                (condition for condition, value in conditions if value is not None),
+                start=3,
+            )
+        ]
+        where_clause = (
+            f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
+        )
+        return f"""
+            PREPARE {name} AS
+            SELECT
+                id,
+                content,
+                source,
+                source_id,
+                document_id,
+                url,
+                created_at,
+                author,
+                embedding,
+                l2_distance(embedding, $1::real[]) AS similarity
+            FROM
+                {self.collection_name}
+            {where_clause}
+            ORDER BY embedding <-> $1::real[] LIMIT $2;
+        """
+
+    def _create_results(self, data: List[Any]) -> List[DocumentChunkWithScore]:
+        results = []
+        for row in data:
+            document_chunk = DocumentChunkWithScore(
+                id=row["id"],
+                text=row["content"],
+                score=float(row["similarity"]),
+                metadata=DocumentChunkMetadata(
+                    source=row["source"],
+                    source_id=row["source_id"],
+                    document_id=row["document_id"],
+                    url=row["url"],
+                    created_at=str(row["created_at"]),
+                    author=row["author"],
+                ),
+            )
+            results.append(document_chunk)
+        return results
+
     async def delete(
         self,
         ids: Optional[List[str]] = None,
@@ -1,16 +1,19 @@
+import asyncio
 import logging
+import math
 import os
 
 import certifi
 import numpy as np
 import pymongo
 
-from pymongo.mongo_client import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
 from abc import ABC, abstractmethod
 
 from typing import Dict, List, Optional
 from datetime import datetime
-from datastore.datastore import DataStore
+from datastore.datastore import DataStore, get_search_width
 from models.models import (
     DocumentChunk,
     DocumentMetadataFilter,
@@ -35,6 +38,42 @@ assert AZCOSMOS_CONTAINER_NAME is not None
 # OpenAI Ada Embeddings Dimension
 VECTOR_DIMENSION = int(os.environ.get("EMBEDDING_DIMENSION", 256))
 
+# Vector index kind, one of vector-ivf, vector-hnsw or vector-diskann, and its parameters
+AZCOSMOS_INDEX_KIND = os.environ.get("AZCOSMOS_INDEX_KIND", "vector-ivf")
+assert AZCOSMOS_INDEX_KIND in ("vector-ivf", "vector-hnsw", "vector-diskann")
+AZCOSMOS_NUM_LISTS = int(os.environ.get("AZCOSMOS_NUM_LISTS", 1))
+AZCOSMOS_SIMILARITY = os.environ.get("AZCOSMOS_SIMILARITY", "COS")
+AZCOSMOS_HNSW_M = int(os.environ.get("AZCOSMOS_HNSW_M", 16))
+AZCOSMOS_HNSW_EF_CONSTRUCTION = int(os.environ.get("AZCOSMOS_HNSW_EF_CONSTRUCTION", 64))
+AZCOSMOS_DISKANN_MAX_DEGREE = int(os.environ.get("AZCOSMOS_DISKANN_MAX_DEGREE", 32))
+AZCOSMOS_DISKANN_L_BUILD = int(os.environ.get("AZCOSMOS_DISKANN_L_BUILD", 50))
+# Apply the metadata filters in the vector search, which needs vector search
+# filtering to be available on the cluster. Otherwise the results are post-filtered
+AZCOSMOS_FILTER_PUSHDOWN = (
+    os.environ.get("AZCOSMOS_FILTER_PUSHDOWN", "true").lower() == "true"
+)
+# Default target recall for queries that don't set one
+AZCOSMOS_RECALL = os.environ.get("AZCOSMOS_RECALL")
+
+# Search parameter defaults of the service, used for a recall of 0.9
+DEFAULT_EF_SEARCH = 40
+DEFAULT_L_SEARCH = 40
+MAX_EF_SEARCH = 1000
+MAX_L_SEARCH = 1000
+
+# Metadata fields that can be filtered on during the vector search
+FILTER_FIELDS = [
+    "document_id",
+    "metadata.author",
+    "metadata.created_at",
+    "metadata.source",
+    "metadata.source_id",
+]
+
+# Number of chunks written per bulk_write, and number of bulk_writes in flight
+AZCOSMOS_UPSERT_BATCH_SIZE = int(os.environ.get("AZCOSMOS_UPSERT_BATCH_SIZE", 100))
+AZCOSMOS_UPSERT_CONCURRENCY = int(os.environ.get("AZCOSMOS_UPSERT_CONCURRENCY", 4))
+
 
 # Abstract class similar to the original data store that allows API level abstraction
 class AzureCosmosDBStoreApi(ABC):
@@ -70,86 +109,162 @@ class AzureCosmosDBStoreApi(ABC):
 
 
 class MongoStoreApi(AzureCosmosDBStoreApi):
-    def __init__(self, mongoClient: MongoClient):
+    def __init__(self, mongoClient: AsyncIOMotorClient):
         self.mongoClient = mongoClient
+        # bounds the bulk writes in flight across concurrent upserts
+        self.upsert_semaphore = asyncio.Semaphore(AZCOSMOS_UPSERT_CONCURRENCY)
 
     @staticmethod
     def _get_metadata_filter(filter: DocumentMetadataFilter) -> dict:
+        # explicit operators, as the vector search filter doesn't accept implicit equality
         returnedFilter: dict = {}
         if filter.document_id is not None:
-            returnedFilter["document_id"] = filter.document_id
+            returnedFilter["document_id"] = {"$eq": filter.document_id}
         if filter.author is not None:
-            returnedFilter["metadata.author"] = filter.author
+            returnedFilter["metadata.author"] = {"$eq": filter.author}
+        if filter.start_date is not None or filter.end_date is not None:
+            returnedFilter["metadata.created_at"] = {}
         if filter.start_date is not None:
-            returnedFilter["metadata.created_at"] = {
-                "$gt": datetime.fromisoformat(filter.start_date)
-            }
+            returnedFilter["metadata.created_at"]["$gte"] = datetime.fromisoformat(
+                filter.start_date
+            )
         if filter.end_date is not None:
-            returnedFilter["metadata.created_at"] = {
-                "$lt": datetime.fromisoformat(filter.end_date)
-            }
+            returnedFilter["metadata.created_at"]["$lte"] = datetime.fromisoformat(
+                filter.end_date
+            )
         if filter.source is not None:
-            returnedFilter["metadata.source"] = filter.source
+            returnedFilter["metadata.source"] = {"$eq": filter.source}
         if filter.source_id is not None:
-            returnedFilter["metadata.source_id"] = filter.source_id
+            returnedFilter["metadata.source_id"] = {"$eq": filter.source_id}
         return returnedFilter
 
+    @staticmethod
+    def _get_index_options(num_lists, similarity) -> dict:
+        options = {
+            "kind": AZCOSMOS_INDEX_KIND,
+            "similarity": similarity,
+            "dimensions": VECTOR_DIMENSION,
+        }
+        if AZCOSMOS_INDEX_KIND == "vector-ivf":
+            options["numLists"] = num_lists
+        elif AZCOSMOS_INDEX_KIND == "vector-hnsw":
+            options["m"] = AZCOSMOS_HNSW_M
+            options["efConstruction"] = AZCOSMOS_HNSW_EF_CONSTRUCTION
+        else:
+            options["maxDegree"] = AZCOSMOS_DISKANN_MAX_DEGREE
+            options["lBuild"] = AZCOSMOS_DISKANN_L_BUILD
+        return options
+
+    def _get_search_options(self, query: QueryWithEmbedding) -> dict:
+        """
+        Maps the requested recall of the query to the search parameter of the index kind.
+        """
+        recall = query.recall
+        if recall is None and AZCOSMOS_RECALL:
+            recall = float(AZCOSMOS_RECALL)
+        if recall is None:
+            return {}
+        # a recall of 0.9 uses the service defaults
+        if AZCOSMOS_INDEX_KIND == "vector-ivf":
+            probes = get_search_width(
+                math.sqrt(self.num_lists), recall, 1, self.num_lists
+            )
+            return {"nProbes": probes}
+        if AZCOSMOS_INDEX_KIND == "vector-hnsw":
+            ef_search = get_search_width(
+                DEFAULT_EF_SEARCH, recall, query.top_k, MAX_EF_SEARCH  # type: ignore
+            )
+            return {"efSearch": ef_search}
+        l_search = get_search_width(
+            DEFAULT_L_SEARCH, recall, query.top_k, MAX_L_SEARCH  # type: ignore
+        )
+        return {"lSearch": l_search}
+
     async def ensure(self, num_lists, similarity):
-        assert self.mongoClient.is_mongos
+        # the same check as MongoClient.is_mongos, without blocking on server selection
+        hello = await self.mongoClient.admin.command("hello")
+        assert hello.get("msg") == "isdbgrid"
         self.collection = self.mongoClient[AZCOSMOS_DATABASE_NAME][
             AZCOSMOS_CONTAINER_NAME
         ]
 
-        indexes = self.collection.index_information()
+        self.num_lists = num_lists
+
+        indexes = await self.collection.index_information()
+        indexDefs: List[any] = []
         if indexes.get("embedding_cosmosSearch") is None:
-            # Ensure the vector index exists.
-            indexDefs: List[any] = [
+            # Ensure the vector index exists. An existing index is kept as is,
+            # drop it to change its kind or parameters.
+            indexDefs.append(
                 {
                     "name": "embedding_cosmosSearch",
                     "key": {"embedding": "cosmosSearch"},
-                    "cosmosSearchOptions": {
-                        "kind": "vector-ivf",
-                        "numLists": num_lists,
-                        "similarity": similarity,
-                        "dimensions": VECTOR_DIMENSION,
-                    },
+                    "cosmosSearchOptions": self._get_index_options(
+                        num_lists, similarity
+                    ),
                 }
-            ]
-            self.mongoClient[AZCOSMOS_DATABASE_NAME].command(
+            )
+        # The filtered fields need their own index to be used by the vector search filter
+        for field in FILTER_FIELDS:
+            if indexes.get(f"{field}_1") is None:
+                indexDefs.append({"name": f"{field}_1", "key": {field: 1}})
+        if indexDefs:
+            await self.mongoClient[AZCOSMOS_DATABASE_NAME].command(
                 "createIndexes", AZCOSMOS_CONTAINER_NAME, indexes=indexDefs
             )
 
     async def upsert_core(self, docId: str, chunks: List[DocumentChunk]) -> List[str]:
         # Until nested doc embedding support is done, treat each chunk as a separate doc.
         doc_ids: List[str] = []
+        requests: List[ReplaceOne] = []
         for chunk in chunks:
             finalDocChunk: dict = {
                 "_id": f"doc:{docId}:chunk:{chunk.id}",
                 "document_id": docId,
                 "embedding": chunk.embedding,
                 "text": chunk.text,
-                "metadata": chunk.metadata.__dict__,
+                "metadata": chunk.metadata.dict(),
             }
 
             if chunk.metadata.created_at is not None:
                 finalDocChunk["metadata"]["created_at"] = datetime.fromisoformat(
                     chunk.metadata.created_at
                 )
-            self.collection.insert_one(finalDocChunk)
+            requests.append(
+                ReplaceOne({"_id": finalDocChunk["_id"]}, finalDocChunk, upsert=True)
+            )
             doc_ids.append(finalDocChunk["_id"])
+
+        async def write_batch(batch: List[ReplaceOne]):
+            async with self.upsert_semaphore:
+                await self.collection.bulk_write(batch, ordered=False)
+
+        await asyncio.gather(
+            *[
+                write_batch(requests[i : i + AZCOSMOS_UPSERT_BATCH_SIZE])
+                for i in range(0, len(requests), AZCOSMOS_UPSERT_BATCH_SIZE)
+            ]
+        )
         return doc_ids
 
     async def query_core(
         self, query: QueryWithEmbedding
     ) -> List[DocumentChunkWithScore]:
+        cosmosSearch = {
+            "vector": query.embedding,
+            "path": "embedding",
+            "k": query.top_k,
+            **self._get_search_options(query),
+        }
+        # pre-filter, so that only the matching vectors are searched
+        if query.filter is not None:
+            searchFilter = self._get_metadata_filter(query.filter)
+            if searchFilter:
+                cosmosSearch["filter"] = searchFilter
         pipeline = [
             {
                 "$search": {
-                    "cosmosSearch": {
-                        "vector": query.embedding,
-                        "path": "embedding",
-                        "k": query.top_k,
-                    },
+                    "cosmosSearch": cosmosSearch,
                     "returnStoredSource": True,
                 }
             },
@@ -161,10 +276,9 @@ class MongoStoreApi(AzureCosmosDBStoreApi):
             },
         ]
 
-        # TODO: Add in match filter (once it can be satisfied).
         # Perform vector search
         query_results: List[DocumentChunkWithScore] = []
-        for aggResult in self.collection.aggregate(pipeline):
+        async for aggResult in self.collection.aggregate(pipeline):
             finalMetadata = aggResult["document"]["metadata"]
             if finalMetadata["created_at"] is not None:
                 finalMetadata["created_at"] = datetime.isoformat(
@@ -180,17 +294,17 @@ class MongoStoreApi(AzureCosmosDBStoreApi):
         return query_results
 
     async def drop_container(self):
-        self.collection.drop()
+        await self.collection.drop()
 
     async def delete_filter(self, filter: DocumentMetadataFilter):
         delete_filter = self._get_metadata_filter(filter)
-        self.collection.delete_many(delete_filter)
+        await self.collection.delete_many(delete_filter)
 
     async def delete_ids(self, ids: List[str]):
-        self.collection.delete_many({"_id": {"$in": ids}})
+        await self.collection.delete_many({"_id": {"$in": ids}})
 
     async def delete_document_ids(self, documentIds: List[str]):
-        self.collection.delete_many({"document_id": {"$in": documentIds}})
+        await self.collection.delete_many({"document_id": {"$in": documentIds}})
 
 
 # Datastore implementation.
@@ -219,12 +333,14 @@ class AzureCosmosDBDataStore(DataStore):
     """
 
     @staticmethod
-    async def create(num_lists, similarity) -> DataStore:
+    async def create(
+        num_lists=AZCOSMOS_NUM_LISTS, similarity=AZCOSMOS_SIMILARITY
+    ) -> DataStore:
         # Create underlying data store based on the API definition.
         # Right now this only supports Mongo, but set up to support more.
         apiStore: AzureCosmosDBStoreApi = None
         if AZCOSMOS_API == "mongo-vcore":
-            mongoClient = MongoClient(AZCOSMOS_CONNSTR)
+            mongoClient = AsyncIOMotorClient(AZCOSMOS_CONNSTR)
             apiStore = MongoStoreApi(mongoClient)
         else:
             raise NotImplementedError
@@ -240,8 +356,13 @@ class AzureCosmosDBDataStore(DataStore):
         """
         # Initialize a list of ids to return
         doc_ids: List[str] = []
-        for doc_id, chunk_list in chunks.items():
-            returnedIds = await self.cosmosStore.upsert_core(doc_id, chunk_list)
+        returnedIdLists = await asyncio.gather(
+            *[
+                self.cosmosStore.upsert_core(doc_id, chunk_list)
+                for doc_id, chunk_list in chunks.items()
+            ]
+        )
+        for returnedIds in returnedIdLists:
             for returnedId in returnedIds:
                 doc_ids.append(returnedId)
         return doc_ids
@@ -254,18 +375,24 @@ class AzureCosmosDBDataStore(DataStore):
         Takes in a list of queries with embeddings and filters and
         returns a list of query results with matching document chunks and scores.
         """
-        # Prepare query responses and results object
-        results: List[QueryResult] = []
+        if not AZCOSMOS_FILTER_PUSHDOWN:
+            # the filters are left out of the vector search and applied to its results
+            return await self._query_with_post_filter(queries, self._query_all)
+        return await self._query_all(queries)
+
+    async def _query_all(
+        self,
+        queries: List[QueryWithEmbedding],
+    ) -> List[QueryResult]:
+        # Gather query results concurrently
+        logging.info(f"Gathering {len(queries)} query results")
 
-        # Gather query results in a pipeline
-        logging.info(f"Gathering {len(queries)} query results", flush=True)
-        for query in queries:
+        async def single_query(query: QueryWithEmbedding) -> QueryResult:
             logging.info(f"Query: {query.query}")
             query_results = await self.cosmosStore.query_core(query)
+            return QueryResult(query=query.query, results=query_results)
 
-            # Add to overall results
-            results.append(QueryResult(query=query.query, results=query_results))
-        return results
+        return await asyncio.gather(*[single_query(query) for query in queries])
 
     async def delete(
         self,
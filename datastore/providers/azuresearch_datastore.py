@@ -2,7 +2,6 @@ import asyncio
 import base64
 import os
 import re
-import time
 from typing import Dict, List, Optional, Union
 
 from azure.core.credentials import AzureKeyCredential
@@ -50,6 +49,10 @@ FIELDS_AUTHOR = os.environ.get("AZURESEARCH_FIELDS_AUTHOR", "author")
 
 MAX_UPLOAD_BATCH_SIZE = 1000
 MAX_DELETE_BATCH_SIZE = 1000
+# Results past the first 1000 are paged through by the client, up to the service skip limit
+MAX_DELETE_SCAN_SIZE = 100000
+# Number of upload or delete batches sent to the service at the same time
+AZURESEARCH_MAX_CONCURRENCY = int(os.environ.get("AZURESEARCH_MAX_CONCURRENCY", 4))
 
 
 class AzureSearchDataStore(DataStore):
@@ -75,14 +78,25 @@ class AzureSearchDataStore(DataStore):
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         azdocuments: List[Dict] = []
+        # batches are uploaded while the next ones are built, the semaphore is taken
+        # before a batch is scheduled so that at most AZURESEARCH_MAX_CONCURRENCY are pending
+        semaphore = asyncio.Semaphore(AZURESEARCH_MAX_CONCURRENCY)
+        uploads: List[asyncio.Task] = []
 
-        async def upload():
-            r = await self.client.upload_documents(documents=azdocuments)
+        async def upload(azdocuments: List[Dict]):
+            try:
+                r = await self.client.upload_documents(documents=azdocuments)
+            finally:
+                semaphore.release()
             count = sum(1 for rr in r if rr.succeeded)
             logger.info(f"Upserted {count} chunks out of {len(azdocuments)}")
             if count < len(azdocuments):
                 raise Exception(f"Failed to upload {len(azdocuments) - count} chunks")
 
+        async def schedule_upload(azdocuments: List[Dict]):
+            await semaphore.acquire()
+            uploads.append(asyncio.create_task(upload(azdocuments)))
+
         ids = []
         for document_id, document_chunks in chunks.items():
             ids.append(document_id)
@@ -105,12 +119,13 @@ class AzureSearchDataStore(DataStore):
                 )
 
                 if len(azdocuments) >= MAX_UPLOAD_BATCH_SIZE:
-                    await upload()
+                    await schedule_upload(azdocuments)
                     azdocuments = []
 
         if len(azdocuments) > 0:
-            await upload()
+            await schedule_upload(azdocuments)
 
+        await asyncio.gather(*uploads)
         return ids
 
     async def delete(
@@ -119,48 +134,77 @@ class AzureSearchDataStore(DataStore):
         filter: Optional[DocumentMetadataFilter] = None,
         delete_all: Optional[bool] = None,
     ) -> bool:
+        # bounds the delete batches in flight across all the filters
+        semaphore = asyncio.Semaphore(AZURESEARCH_MAX_CONCURRENCY)
         filter = None if delete_all else self._translate_filter(filter)
         if delete_all or filter is not None:
-            deleted = set()
-            while True:
-                search_result = await self.client.search(
-                    None,
-                    filter=filter,
-                    top=MAX_DELETE_BATCH_SIZE,
-                    include_total_count=True,
-                    select=FIELDS_ID,
-                )
-                if await search_result.get_count() == 0:
-                    break
-                documents = [
-                    {FIELDS_ID: d[FIELDS_ID]}
-                    async for d in search_result
-                    if d[FIELDS_ID] not in deleted
-                ]
-                if len(documents) > 0:
-                    logger.info(
-                        f"Deleting {len(documents)} chunks "
-                        + (
-                            "using a filter"
-                            if filter is not None
-                            else "using delete_all"
-                        )
-                    )
-                    del_result = await self.client.delete_documents(documents=documents)
-                    if not all([rr.succeeded for rr in del_result]):
-                        raise Exception("Failed to delete documents")
-                    deleted.update([d[FIELDS_ID] for d in documents])
-                else:
-                    # All repeats, delay a bit to let the index refresh and try again
-                    time.sleep(0.25)
+            await self._delete_matching(filter, semaphore)
 
         if ids is not None and len(ids) > 0:
-            for id in ids:
-                logger.info(f"Deleting chunks for document id {id}")
-                await self.delete(filter=DocumentMetadataFilter(document_id=id))
+            logger.info(f"Deleting chunks for document ids {ids}")
+            await asyncio.gather(
+                *(
+                    self._delete_matching(
+                        self._translate_filter(DocumentMetadataFilter(document_id=id)),
+                        semaphore,
+                    )
+                    for id in ids
+                )
+            )
 
         return True
 
+    async def _delete_matching(
+        self, filter: Optional[str], semaphore: asyncio.Semaphore
+    ):
+        """
+        Deletes all the chunks matching the filter, or all the chunks if the filter is None.
+        Batches are deleted while the search results are still being paged through.
+        """
+        deleted = set()
+
+        async def delete_batch(documents: List[Dict]):
+            try:
+                del_result = await self.client.delete_documents(documents=documents)
+            finally:
+                semaphore.release()
+            if not all([rr.succeeded for rr in del_result]):
+                raise Exception("Failed to delete documents")
+
+        while True:
+            search_result = await self.client.search(
+                None,
+                filter=filter,
+                top=MAX_DELETE_SCAN_SIZE,
+                include_total_count=True,
+                select=FIELDS_ID,
+            )
+            if await search_result.get_count() == 0:
+                break
+            deletes: List[asyncio.Task] = []
+            documents: List[Dict] = []
+            async for d in search_result:
+                if d[FIELDS_ID] in deleted:
+                    continue
+                deleted.add(d[FIELDS_ID])
+                documents.append({FIELDS_ID: d[FIELDS_ID]})
+                if len(documents) >= MAX_DELETE_BATCH_SIZE:
+                    await semaphore.acquire()
+                    deletes.append(asyncio.create_task(delete_batch(documents)))
+                    documents = []
+            if len(documents) > 0:
+                await semaphore.acquire()
+                deletes.append(asyncio.create_task(delete_batch(documents)))
+            if len(deletes) > 0:
+                logger.info(
+                    f"Deleting chunks in {len(deletes)} batches "
+                    + ("using a filter" if filter is not None else "using delete_all")
+                )
+                await asyncio.gather(*deletes)
+            else:
+                # All repeats, delay a bit to let the index refresh and try again
+                await asyncio.sleep(0.25)
+
     async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
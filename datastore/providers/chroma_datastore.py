@@ -7,15 +7,16 @@ Consult the Chroma docs and GitHub repo for more information:
 - https://www.trychroma.com/
 """
 
+import asyncio
+import json
 import os
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import chromadb
 
 from datastore.datastore import DataStore
 from models.models import (
-    Document,
     DocumentChunk,
     DocumentChunkMetadata,
     DocumentChunkWithScore,
@@ -24,13 +25,14 @@ from models.models import (
     QueryWithEmbedding,
     Source,
 )
-from services.chunks import get_document_chunks
 
 CHROMA_IN_MEMORY = os.environ.get("CHROMA_IN_MEMORY", "True")
 CHROMA_PERSISTENCE_DIR = os.environ.get("CHROMA_PERSISTENCE_DIR", "openai")
 CHROMA_HOST = os.environ.get("CHROMA_HOST", "http://127.0.0.1")
 CHROMA_PORT = os.environ.get("CHROMA_PORT", "8000")
 CHROMA_COLLECTION = os.environ.get("CHROMA_COLLECTION", "openaiembeddings")
+# capped by the max batch size of the client when it reports one
+CHROMA_UPSERT_BATCH_SIZE = int(os.environ.get("CHROMA_UPSERT_BATCH_SIZE", 1000))
 
 
 class ChromaDataStore(DataStore):
@@ -69,19 +71,17 @@ class ChromaDataStore(DataStore):
             name=collection_name,
             embedding_function=None,
         )
+        # number of embeddings in the collection, refreshed on upsert and delete
+        self._count: Optional[int] = None
 
-    async def upsert(
-        self, documents: List[Document], chunk_token_size: Optional[int] = None
-    ) -> List[str]:
-        """
-        Takes in a list of documents and inserts them into the database. If an id already exists, the document is updated.
-        Return a list of document ids.
-        """
-
-        chunks = get_document_chunks(documents, chunk_token_size)
+    async def _refresh_count(self) -> int:
+        self._count = await asyncio.to_thread(self._collection.count)
+        return self._count
 
-        # Chroma has a true upsert, so we don't need to delete first
-        return await self._upsert(chunks)
+    async def _get_count(self) -> int:
+        if self._count is None:
+            return await self._refresh_count()
+        return self._count
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
@@ -89,24 +89,55 @@ class ChromaDataStore(DataStore):
         Return a list of document ids.
         """
 
-        self._collection.upsert(
-            ids=[chunk.id for chunk_list in chunks.values() for chunk in chunk_list],
-            embeddings=[
-                chunk.embedding
-                for chunk_list in chunks.values()
-                for chunk in chunk_list
-            ],
-            documents=[
-                chunk.text for chunk_list in chunks.values() for chunk in chunk_list
-            ],
-            metadatas=[
-                self._process_metadata_for_storage(chunk.metadata)
-                for chunk_list in chunks.values()
-                for chunk in chunk_list
-            ],
-        )
+        batch_size = CHROMA_UPSERT_BATCH_SIZE
+        max_batch_size = getattr(self._client, "max_batch_size", None)
+        if max_batch_size:
+            batch_size = min(batch_size, max_batch_size)
+
+        for ids, embeddings, documents, metadatas in self._iter_upsert_batches(
+            chunks, batch_size
+        ):
+            await asyncio.to_thread(
+                self._collection.upsert,
+                ids=ids,
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas,
+            )
+        await self._refresh_count()
         return list(chunks.keys())
 
+    def _iter_upsert_batches(
+        self, chunks: Dict[str, List[DocumentChunk]], batch_size: int
+    ) -> Iterator[Tuple[List[str], List[List[float]], List[str], List[Dict]]]:
+        """
+        Yields the ids, embeddings, documents and metadatas of the chunks, batch_size chunks at a time.
+        """
+        ids: List[str] = []
+        embeddings: List[List[float]] = []
+        documents: List[str] = []
+        metadatas: List[Dict] = []
+        for chunk_list in chunks.values():
+            if not chunk_list:
+                continue
+            # the chunks of a document have the same metadata, so it is only converted once
+            stored_metadata = self._process_metadata_for_storage(chunk_list[0].metadata)
+            for chunk in chunk_list:
+                ids.append(chunk.id)  # type: ignore
+                embeddings.append(chunk.embedding)  # type: ignore
+                documents.append(chunk.text)
+                # the hash is added per chunk, outside the metadata returned by queries
+                metadatas.append(
+                    {**stored_metadata, "content_hash": chunk.content_hash}
+                    if chunk.content_hash
+                    else stored_metadata
+                )
+                if len(ids) == batch_size:
+                    yield ids, embeddings, documents, metadatas
+                    ids, embeddings, documents, metadatas = [], [], [], []
+        if ids:
+            yield ids, embeddings, documents, metadatas
+
     def _where_from_query_filter(self, query_filter: DocumentMetadataFilter) -> Dict:
         output = {
             k: v
@@ -174,21 +205,70 @@ class ChromaDataStore(DataStore):
             document_id=metadata.get("document_id", None),
         )
 
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Optional[str]]]]:
+        """
+        Returns the content hash of each stored chunk by chunk id, for each of the documents.
+        """
+        if len(document_ids) > 1:
+            where = {"$or": [{"document_id": id_} for id_ in document_ids]}
+        else:
+            (id_,) = document_ids
+            where = {"document_id": id_}
+        result = await asyncio.to_thread(
+            self._collection.get, where=where, include=["metadatas"]
+        )
+
+        hashes: Dict[str, Dict[str, Optional[str]]] = {id_: {} for id_ in document_ids}
+        for chunk_id, metadata in zip(result["ids"], result["metadatas"]):
+            hashes[metadata["document_id"]][chunk_id] = metadata.get("content_hash")
+        return hashes
+
+    async def _delete_chunks(self, chunk_ids: Dict[str, List[str]]) -> None:
+        await asyncio.to_thread(
+            self._collection.delete,
+            ids=[id_ for ids in chunk_ids.values() for id_ in ids],
+        )
+        await self._refresh_count()
+
     async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
-        results = [
-            self._collection.query(
-                query_embeddings=[query.embedding],
-                include=["documents", "distances", "metadatas"],  # embeddings
-                n_results=min(query.top_k, self._collection.count()),  # type: ignore
-                where=(
-                    self._where_from_query_filter(query.filter) if query.filter else {}
-                ),
-            )
-            for query in queries
-        ]
+        # queries sharing a filter are sent in a single call
+        groups: Dict[str, List[int]] = {}
+        wheres: Dict[str, Dict] = {}
+        for i, query in enumerate(queries):
+            where = self._where_from_query_filter(query.filter) if query.filter else {}
+            key = json.dumps(where, sort_keys=True)
+            groups.setdefault(key, []).append(i)
+            wheres[key] = where
+
+        count = await self._get_count()
+        # the local duckdb client isn't safe to query from several threads at once,
+        # so the groups are sent one after the other from a single worker thread
+        group_results = await asyncio.to_thread(
+            lambda: [
+                self._collection.query(
+                    query_embeddings=[queries[i].embedding for i in indices],
+                    include=["documents", "distances", "metadatas"],  # embeddings
+                    n_results=min(max(queries[i].top_k for i in indices), count),  # type: ignore
+                    where=wheres[key],
+                )
+                for key, indices in groups.items()
+            ]
+        )
+
+        # split the results of each call back per query, keeping at most its own top_k
+        results: List[Dict] = [None] * len(queries)  # type: ignore
+        for indices, group_result in zip(groups.values(), group_results):
+            for position, i in enumerate(indices):
+                results[i] = {
+                    field: [values[position][: queries[i].top_k]]
+                    for field, values in group_result.items()
+                    if field in ("ids", "documents", "metadatas", "distances")
+                }
 
         output = []
         for query, result in zip(queries, results):
@@ -230,6 +310,7 @@ class ChromaDataStore(DataStore):
         """
         if delete_all:
             self._collection.delete()
+            self._count = 0
             return True
 
         if ids and len(ids) > 0:
@@ -247,4 +328,5 @@ class ChromaDataStore(DataStore):
             where_clause = self._where_from_query_filter(filter)
 
         self._collection.delete(where=where_clause)
+        await self._refresh_count()
         return True
@@ -1,11 +1,13 @@
+import asyncio
+import math
 import os
 from typing import Dict, List, Any, Optional
 
 import elasticsearch
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import AsyncElasticsearch, Elasticsearch, helpers
 from loguru import logger
 
-from datastore.datastore import DataStore
+from datastore.datastore import DataStore, get_search_width
 from models.models import (
     DocumentChunk,
     DocumentChunkWithScore,
@@ -27,7 +29,20 @@ ELASTICSEARCH_SHARDS = int(os.environ.get("ELASTICSEARCH_SHARDS", "1"))
 
 VECTOR_SIZE = int(os.environ.get("EMBEDDING_DIMENSION", 256))
 
-UPSERT_BATCH_SIZE = 100
+ELASTICSEARCH_BULK_CHUNK_SIZE = int(
+    os.environ.get("ELASTICSEARCH_BULK_CHUNK_SIZE", "500")
+)
+ELASTICSEARCH_BULK_CONCURRENCY = int(
+    os.environ.get("ELASTICSEARCH_BULK_CONCURRENCY", "4")
+)
+# kNN candidates gathered on each shard per requested result, at a recall of 0.9
+ELASTICSEARCH_NUM_CANDIDATES_FACTOR = float(
+    os.environ.get("ELASTICSEARCH_NUM_CANDIDATES_FACTOR", "1.5")
+)
+ELASTICSEARCH_RECALL = os.environ.get("ELASTICSEARCH_RECALL")
+
+# upper bound of num_candidates accepted by Elasticsearch
+MAX_NUM_CANDIDATES = 10000
 
 
 class ElasticsearchDataStore(DataStore):
@@ -56,7 +71,7 @@ class ElasticsearchDataStore(DataStore):
         assert replicas > 0, "Replicas must be greater than or equal to 0."
         assert shards > 0, "Shards must be greater than or equal to 0."
 
-        self.client = connect_to_elasticsearch(
+        connection_params = get_connection_params(
             ELASTICSEARCH_URL,
             ELASTICSEARCH_CLOUD_ID,
             ELASTICSEARCH_API_KEY,
@@ -71,23 +86,53 @@ class ElasticsearchDataStore(DataStore):
         replicas = replicas or ELASTICSEARCH_REPLICAS
         shards = shards or ELASTICSEARCH_SHARDS
 
-        # Set up the collection so the documents might be inserted or queried
-        self._set_up_index(vector_size, similarity, replicas, shards, recreate_index)
+        # Set up the collection so the documents might be inserted or queried. The
+        # constructor can't await, so a short-lived sync client is used for it
+        setup_client = connect_to_elasticsearch(**connection_params)
+        try:
+            self._set_up_index(
+                setup_client, vector_size, similarity, replicas, shards, recreate_index
+            )
+        finally:
+            setup_client.close()
+
+        self.client = AsyncElasticsearch(**connection_params)
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
         Takes in a list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
-        actions = []
-        for _, chunkList in chunks.items():
-            for chunk in chunkList:
-                actions = (
-                    actions
-                    + self._convert_document_chunk_to_es_document_operation(chunk)
-                )
+        actions = [
+            self._convert_document_chunk_to_es_document_operation(chunk)
+            for _, chunkList in chunks.items()
+            for chunk in chunkList
+        ]
 
-        self.client.bulk(operations=actions, index=self.index_name)
+        async def _stream_bulk(partition: List[Dict]):
+            # the helper sends the actions in requests of chunk_size documents and
+            # raises if any of them fails to be indexed
+            async for _ in helpers.async_streaming_bulk(
+                self.client, partition, chunk_size=ELASTICSEARCH_BULK_CHUNK_SIZE
+            ):
+                pass
+
+        # split the actions in partitions of whole chunks, streamed in parallel
+        chunks_per_partition = max(
+            1,
+            math.ceil(
+                len(actions)
+                / ELASTICSEARCH_BULK_CHUNK_SIZE
+                / ELASTICSEARCH_BULK_CONCURRENCY
+            ),
+        )
+        partition_size = chunks_per_partition * ELASTICSEARCH_BULK_CHUNK_SIZE
+        await asyncio.gather(
+            *[
+                _stream_bulk(actions[i : i + partition_size])
+                for i in range(0, len(actions), partition_size)
+            ]
+        )
         return list(chunks.keys())
 
     async def _query(
@@ -98,7 +143,7 @@ class ElasticsearchDataStore(DataStore):
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
         searches = self._convert_queries_to_msearch_query(queries)
-        results = self.client.msearch(searches=searches)
+        results = await self.client.msearch(searches=searches)
         return [
             QueryResult(
                 query=query.query,
@@ -125,7 +170,7 @@ class ElasticsearchDataStore(DataStore):
         if delete_all:
             try:
                 logger.info(f"Deleting all vectors from index")
-                self.client.delete_by_query(
+                await self.client.delete_by_query(
                     index=self.index_name, query={"match_all": {}}
                 )
                 logger.info(f"Deleted all vectors successfully")
@@ -140,7 +185,9 @@ class ElasticsearchDataStore(DataStore):
         if es_filters != {}:
             try:
                 logger.info(f"Deleting vectors with filter {es_filters}")
-                self.client.delete_by_query(index=self.index_name, query=es_filters)
+                await self.client.delete_by_query(
+                    index=self.index_name, query=es_filters
+                )
                 logger.info(f"Deleted vectors with filter successfully")
             except Exception as e:
                 logger.error(f"Error deleting vectors with filter: {e}")
@@ -150,7 +197,7 @@ class ElasticsearchDataStore(DataStore):
             try:
                 documents_to_delete = [doc_id for doc_id in ids]
                 logger.info(f"Deleting {len(documents_to_delete)} documents")
-                res = self.client.delete_by_query(
+                res = await self.client.delete_by_query(
                     index=self.index_name,
                     query={"terms": {"metadata.document_id": documents_to_delete}},
                 )
@@ -195,30 +242,26 @@ class ElasticsearchDataStore(DataStore):
 
     def _convert_document_chunk_to_es_document_operation(
         self, document_chunk: DocumentChunk
-    ) -> List[Dict]:
+    ) -> Dict:
         created_at = (
             to_unix_timestamp(document_chunk.metadata.created_at)
             if document_chunk.metadata.created_at is not None
             else None
         )
 
-        action_and_metadata = {
-            "index": {
-                "_index": self.index_name,
-                "_id": document_chunk.id,
-            }
-        }
-
-        source = {
-            "id": document_chunk.id,
-            "text": document_chunk.text,
-            "metadata": document_chunk.metadata.dict(),
-            "created_at": created_at,
-            "embedding": document_chunk.embedding,
+        return {
+            "_op_type": "index",
+            "_index": self.index_name,
+            "_id": document_chunk.id,
+            "_source": {
+                "id": document_chunk.id,
+                "text": document_chunk.text,
+                "metadata": document_chunk.metadata.dict(),
+                "created_at": created_at,
+                "embedding": document_chunk.embedding,
+            },
         }
 
-        return [action_and_metadata, source]
-
     def _convert_queries_to_msearch_query(self, queries: List[QueryWithEmbedding]):
         searches = []
 
@@ -226,12 +269,13 @@ class ElasticsearchDataStore(DataStore):
             searches.append({"index": self.index_name})
             searches.append(
                 {
-                    "_source": True,
+                    # the embedding is the bulk of the document and isn't needed in the results
+                    "_source": {"excludes": ["embedding"]},
                     "knn": {
                         "field": "embedding",
                         "query_vector": query.embedding,
                         "k": query.top_k,
-                        "num_candidates": query.top_k,
+                        "num_candidates": self._get_num_candidates(query),
                     },
                     "size": query.top_k,
                 }
@@ -239,17 +283,33 @@ class ElasticsearchDataStore(DataStore):
 
         return searches
 
+    def _get_num_candidates(self, query: QueryWithEmbedding) -> int:
+        """
+        Maps the requested recall of the query to the number of kNN candidates.
+        """
+        top_k = query.top_k or 1
+        recall = query.recall
+        if recall is None and ELASTICSEARCH_RECALL:
+            recall = float(ELASTICSEARCH_RECALL)
+        return get_search_width(
+            top_k * ELASTICSEARCH_NUM_CANDIDATES_FACTOR,
+            recall,
+            top_k,
+            MAX_NUM_CANDIDATES,
+        )
+
     def _convert_hit_to_document_chunk_with_score(self, hit) -> DocumentChunkWithScore:
         return DocumentChunkWithScore(
             id=hit["_id"],
             text=hit["_source"]["text"],  # type: ignore
             metadata=hit["_source"]["metadata"],  # type: ignore
-            embedding=hit["_source"]["embedding"],  # type: ignore
+            embedding=hit["_source"].get("embedding"),  # type: ignore
             score=hit["_score"],
         )
 
     def _set_up_index(
         self,
+        client: Elasticsearch,
         vector_size: int,
         similarity: str,
         replicas: int,
@@ -257,10 +317,10 @@ class ElasticsearchDataStore(DataStore):
         recreate_index: bool,
     ) -> None:
         if recreate_index:
-            self._recreate_index(similarity, vector_size, replicas, shards)
+            self._recreate_index(client, similarity, vector_size, replicas, shards)
 
         try:
-            index_mapping = self.client.indices.get_mapping(index=self.index_name)
+            index_mapping = client.indices.get_mapping(index=self.index_name)
             current_similarity = index_mapping[self.index_name]["mappings"]["properties"]["embedding"]["similarity"]  # type: ignore
             current_vector_size = index_mapping[self.index_name]["mappings"]["properties"]["embedding"]["dims"]  # type: ignore
 
@@ -280,10 +340,15 @@ class ElasticsearchDataStore(DataStore):
                     f"vector size, please set `recreate_index=True` argument."
                 )
         except elasticsearch.exceptions.NotFoundError:
-            self._recreate_index(similarity, vector_size, replicas, shards)
+            self._recreate_index(client, similarity, vector_size, replicas, shards)
 
     def _recreate_index(
-        self, similarity: str, vector_size: int, replicas: int, shards: int
+        self,
+        client: Elasticsearch,
+        similarity: str,
+        vector_size: int,
+        replicas: int,
+        shards: int,
     ) -> None:
         settings = {
             "index": {
@@ -303,17 +368,17 @@ class ElasticsearchDataStore(DataStore):
             }
         }
 
-        self.client.indices.delete(
+        client.indices.delete(
             index=self.index_name, ignore_unavailable=True, allow_no_indices=True
         )
-        self.client.indices.create(
+        client.indices.create(
             index=self.index_name, mappings=mappings, settings=settings
         )
 
 
-def connect_to_elasticsearch(
+def get_connection_params(
     elasticsearch_url=None, cloud_id=None, api_key=None, username=None, password=None
-):
+) -> Dict[str, Any]:
     # Check if both elasticsearch_url and cloud_id are defined
     if elasticsearch_url and cloud_id:
         raise ValueError(
@@ -341,6 +406,10 @@ def connect_to_elasticsearch(
             "No authentication details provided. Please consider using an api_key or username and password to secure your connection."
         )
 
+    return connection_params
+
+
+def connect_to_elasticsearch(**connection_params) -> Elasticsearch:
     # Establish the Elasticsearch client connection
     es_client = Elasticsearch(**connection_params)
     try:
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 from typing import Dict, List, Optional, Type
@@ -28,6 +29,8 @@ INDEX_STRUCT_TYPE_STR = os.environ.get(
 INDEX_JSON_PATH = os.environ.get("LLAMA_INDEX_JSON_PATH", None)
 QUERY_KWARGS_JSON_PATH = os.environ.get("LLAMA_QUERY_KWARGS_JSON_PATH", None)
 RESPONSE_MODE = os.environ.get("LLAMA_RESPONSE_MODE", ResponseMode.NO_TEXT.value)
+# seconds between snapshots of the index to LLAMA_INDEX_JSON_PATH, when it changed
+PERSIST_INTERVAL = float(os.environ.get("LLAMA_PERSIST_INTERVAL", 30))
 
 EXTERNAL_VECTOR_STORE_INDEX_STRUCT_TYPES = [
     IndexStructType.DICT,
@@ -59,8 +62,8 @@ def _create_or_load_index(
         raise ValueError("Please use vector store directly.")
 
     index_cls = index_type_to_index_cls[index_type]
-    if index_json_path is None:
-        return index_cls(nodes=[])  # Create empty index
+    if index_json_path is None or not os.path.exists(index_json_path):
+        return index_cls(nodes=[])  # Create empty index, persisted on first change
     else:
         return index_cls.load_from_disk(index_json_path)  # Load index from disk
 
@@ -88,6 +91,14 @@ def _doc_chunk_to_node(doc_chunk: DocumentChunk, source_doc_id: str) -> Node:
     )
 
 
+def _write_index_snapshot(index_json_path: str, index_str: str) -> None:
+    """Write the index snapshot, replacing the previous one only once it is complete."""
+    tmp_path = f"{index_json_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(index_str)
+    os.replace(tmp_path, index_json_path)
+
+
 def _query_with_embedding_to_query_bundle(query: QueryWithEmbedding) -> QueryBundle:
     return QueryBundle(
         query_str=query.query,
@@ -126,10 +137,57 @@ def _response_to_query_result(
 
 class LlamaDataStore(DataStore):
     def __init__(
-        self, index: Optional[BaseGPTIndex] = None, query_kwargs: Optional[dict] = None
+        self,
+        index: Optional[BaseGPTIndex] = None,
+        query_kwargs: Optional[dict] = None,
+        index_json_path: Optional[str] = INDEX_JSON_PATH,
     ):
-        self._index = index or _create_or_load_index()
+        self._index = index or _create_or_load_index(index_json_path=index_json_path)
         self._query_kwargs = query_kwargs or _create_or_load_query_kwargs()
+        # Changes are snapshot to the json path in the background, if one is set
+        self._index_json_path = index_json_path
+        self._dirty = False
+        self._persist_task: Optional[asyncio.Task] = None
+
+    def _mark_dirty(self) -> None:
+        self._dirty = True
+        if self._index_json_path is not None and self._persist_task is None:
+            # started lazily, as it needs a running event loop
+            self._persist_task = asyncio.create_task(self._persist_periodically())
+
+    async def _persist_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(PERSIST_INTERVAL)
+            try:
+                await self.persist()
+            except Exception as e:
+                logger.error(f"Failed to persist the index: {e}")
+
+    async def persist(self) -> None:
+        """
+        Writes a snapshot of the index to the json path if it changed since the last one.
+        """
+        if self._index_json_path is None or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            # serialized on the event loop, so no upsert changes the index meanwhile
+            index_str = self._index.save_to_string()
+            await asyncio.to_thread(
+                _write_index_snapshot, self._index_json_path, index_str
+            )
+        except Exception:
+            self._dirty = True
+            raise
+
+    async def close(self) -> None:
+        """
+        Stops the periodic snapshots and writes the changes made since the last one.
+        """
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            self._persist_task = None
+        await self.persist()
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
@@ -137,16 +195,19 @@ class LlamaDataStore(DataStore):
         Return a list of document ids.
         """
         doc_ids = []
+        nodes = []
         for doc_id, doc_chunks in chunks.items():
             logger.debug(f"Upserting {doc_id} with {len(doc_chunks)} chunks")
 
-            nodes = [
+            nodes.extend(
                 _doc_chunk_to_node(doc_chunk=doc_chunk, source_doc_id=doc_id)
                 for doc_chunk in doc_chunks
-            ]
-
-            self._index.insert_nodes(nodes)
+            )
             doc_ids.append(doc_id)
+
+        # a single insert for the whole request
+        self._index.insert_nodes(nodes)
+        self._mark_dirty()
         return doc_ids
 
     async def _query(
@@ -157,16 +218,23 @@ class LlamaDataStore(DataStore):
         Takes in a list of queries with embeddings and filters and
         returns a list of query results with matching document chunks and scores.
         """
-        query_result_all = []
-        for query in queries:
-            if query.filter is not None:
-                logger.warning("Filters are not supported yet, ignoring for now.")
+        # the index has no metadata filters, they are applied to the results
+        return await self._query_with_post_filter(queries, self._query_unfiltered)
+
+    async def _query_unfiltered(
+        self,
+        queries: List[QueryWithEmbedding],
+    ) -> List[QueryResult]:
+        """
+        Runs the queries against the index, ignoring their filters.
+        """
 
+        async def _single_query(query: QueryWithEmbedding) -> QueryResult:
             query_bundle = _query_with_embedding_to_query_bundle(query)
 
-            # Setup query kwargs
+            # Setup query kwargs, copied as the queries run concurrently
             if self._query_kwargs is not None:
-                query_kwargs = self._query_kwargs
+                query_kwargs = dict(self._query_kwargs)
             else:
                 query_kwargs = {}
             # TODO: support top_k for other indices
@@ -177,10 +245,9 @@ class LlamaDataStore(DataStore):
                 query_bundle, response_mode=RESPONSE_MODE, **query_kwargs
             )
 
-            query_result = _response_to_query_result(response, query)
-            query_result_all.append(query_result)
+            return _response_to_query_result(response, query)
 
-        return query_result_all
+        return await asyncio.gather(*[_single_query(query) for query in queries])
 
     async def delete(
         self,
@@ -208,5 +275,6 @@ class LlamaDataStore(DataStore):
                     # NOTE: some indices does not support delete yet.
                     logger.warning(f"{type(self._index)} does not support delete yet.")
                     return False
+                self._mark_dirty()
 
         return True
@@ -39,7 +39,9 @@ MILVUS_INDEX_PARAMS = os.environ.get("MILVUS_INDEX_PARAMS")
 MILVUS_SEARCH_PARAMS = os.environ.get("MILVUS_SEARCH_PARAMS")
 MILVUS_CONSISTENCY_LEVEL = os.environ.get("MILVUS_CONSISTENCY_LEVEL")
 
-UPSERT_BATCH_SIZE = 100
+# Keep insert requests well below the gRPC message size limit of the server
+UPSERT_BATCH_BYTES = int(os.environ.get("MILVUS_UPSERT_BATCH_BYTES", 16 * 1024 * 1024))
+UPSERT_CONCURRENCY = int(os.environ.get("MILVUS_UPSERT_CONCURRENCY", 4))
 OUTPUT_DIM = int(os.environ.get("EMBEDDING_DIMENSION", 256))
 EMBEDDING_FIELD = "embedding"
 
@@ -323,9 +325,9 @@ class MilvusDataStore(DataStore):
         try:
             # The doc id's to return for the upsert
             doc_ids: List[str] = []
-            # List to collect all the insert data, skip the "pk" for schema V1
-            offset = 1 if self._schema_ver == "V1" else 0
-            insert_data = [[] for _ in range(len(self._get_schema()) - offset)]
+            # Rows of insert data, batched by their estimated size in bytes
+            batches: List[List[List]] = [[]]
+            batch_bytes = 0
 
             # Go through each document chunklist and grab the data
             for doc_id, chunk_list in chunks.items():
@@ -337,34 +339,60 @@ class MilvusDataStore(DataStore):
                     list_of_data = self._get_values(chunk)
                     # Check if the data is valid
                     if list_of_data is not None:
-                        # Append each field to the insert_data
-                        for x in range(len(insert_data)):
-                            insert_data[x].append(list_of_data[x])
-            # Slice up our insert data into batches
-            batches = [
-                insert_data[i : i + UPSERT_BATCH_SIZE]
-                for i in range(0, len(insert_data), UPSERT_BATCH_SIZE)
-            ]
-
-            # Attempt to insert each batch into our collection
-            # batch data can work with both V1 and V2 schema
-            for batch in batches:
-                if len(batch[0]) != 0:
+                        row_bytes = self._get_row_bytes(list_of_data)
+                        # Start a new batch if this row would overflow the current one
+                        if batches[-1] and batch_bytes + row_bytes > UPSERT_BATCH_BYTES:
+                            batches.append([])
+                            batch_bytes = 0
+                        batches[-1].append(list_of_data)
+                        batch_bytes += row_bytes
+
+            semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
+
+            async def _insert_batch(rows: List[List]) -> None:
+                async with semaphore:
                     try:
-                        logger.info(f"Upserting batch of size {len(batch[0])}")
-                        self.col.insert(batch)
+                        logger.info(f"Upserting batch of size {len(rows)}")
+                        # Transpose the rows into the column based insert data,
+                        # batch data can work with both V1 and V2 schema
+                        insert_data = [list(column) for column in zip(*rows)]
+                        await asyncio.to_thread(self.col.insert, insert_data)
                         logger.info(f"Upserted batch successfully")
                     except Exception as e:
                         logger.error(f"Failed to insert batch records, error: {e}")
                         raise e
 
-            # This setting perfoms flushes after insert. Small insert == bad to use
-            # self.col.flush()
+            # Insert the batches into our collection concurrently
+            await asyncio.gather(*[_insert_batch(rows) for rows in batches if rows])
+
+            # Flushing after small inserts creates small segments, so only flush large imports once at the end
+            if len(batches) > 1:
+                await asyncio.to_thread(self.col.flush)
             return doc_ids
         except Exception as e:
             logger.error("Failed to insert records, error: {}".format(e))
             return []
 
+    def _get_row_bytes(self, values: List) -> int:
+        """Estimate the size of a row of insert data in bytes.
+
+        Args:
+            values (List): The values of the row, as returned by _get_values.
+
+        Returns:
+            int: The estimated size of the row.
+        """
+        size = 0
+        for value in values:
+            if isinstance(value, str):
+                size += len(value.encode("utf-8"))
+            elif isinstance(value, list):
+                # Float vectors are sent as 4 byte floats
+                size += 4 * len(value)
+            else:
+                size += 8
+        return size
+
     def _get_values(self, chunk: DocumentChunk) -> List[any] | None:  # type: ignore
         """Convert the chunk into a list of values to insert whose indexes align with fields.
 
@@ -417,65 +445,92 @@ class MilvusDataStore(DataStore):
             List[QueryResult]: Results for each search.
         """
 
-        # Async to perform the query, adapted from pinecone implementation
-        async def _single_query(query: QueryWithEmbedding) -> QueryResult:
+        # Queries sharing a filter expression are sent in a single search
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, query in enumerate(queries):
+            filter = None
+            # Set the filter to expression that is valid for Milvus
+            if query.filter is not None:
+                # Either a valid filter or None will be returned
+                filter = self._get_filter(query.filter) or None
+            groups.setdefault(filter, []).append(i)
+
+        # Results default to empty if the search of their group fails
+        results: List[QueryResult] = [
+            QueryResult(query=query.query, results=[]) for query in queries
+        ]
+
+        async def _group_query(filter: Optional[str], indices: List[int]) -> None:
             try:
-                filter = None
-                # Set the filter to expression that is valid for Milvus
-                if query.filter is not None:
-                    # Either a valid filter or None will be returned
-                    filter = self._get_filter(query.filter)
-
-                # Perform our search
+                # Perform our search in the thread pool, with room for the largest top_k of the group
                 return_from = 2 if self._schema_ver == "V1" else 1
-                res = self.col.search(
-                    data=[query.embedding],
+                res = await asyncio.to_thread(
+                    self.col.search,
+                    data=[queries[i].embedding for i in indices],
                     anns_field=EMBEDDING_FIELD,
                     param=self.search_params,
-                    limit=query.top_k,
+                    limit=max(queries[i].top_k for i in indices),  # type: ignore
                     expr=filter,
                     output_fields=[
                         field[0] for field in self._get_schema()[return_from:]
                     ],  # Ignoring pk, embedding
                 )
-                # Results that will hold our DocumentChunkWithScores
-                results = []
-                # Parse every result for our search
-                for hit in res[0]:  # type: ignore
-                    # The distance score for the search result, falls under DocumentChunkWithScore
-                    score = hit.score
-                    # Our metadata info, falls under DocumentChunkMetadata
-                    metadata = {}
-                    # Grab the values that correspond to our fields, ignore pk and embedding.
-                    for x in [field[0] for field in self._get_schema()[return_from:]]:
-                        metadata[x] = hit.entity.get(x)
-                    # If the source isn't valid, convert to None
-                    if metadata["source"] not in Source.__members__:
-                        metadata["source"] = None
-                    # Text falls under the DocumentChunk
-                    text = metadata.pop("text")
-                    # Id falls under the DocumentChunk
-                    ids = metadata.pop("id")
-                    chunk = DocumentChunkWithScore(
-                        id=ids,
-                        score=score,
-                        text=text,
-                        metadata=DocumentChunkMetadata(**metadata),
+                # The hits of each vector are in the same order as the data
+                for i, hits in zip(indices, res):  # type: ignore
+                    chunks = self._get_chunks_from_hits(hits, return_from)
+                    results[i] = QueryResult(
+                        query=queries[i].query, results=chunks[: queries[i].top_k]
                     )
-                    results.append(chunk)
-
-                # TODO: decide on doing queries to grab the embedding itself, slows down performance as double query occurs
-
-                return QueryResult(query=query.query, results=results)
             except Exception as e:
                 logger.error("Failed to query, error: {}".format(e))
-                return QueryResult(query=query.query, results=[])
 
-        results: List[QueryResult] = await asyncio.gather(
-            *[_single_query(query) for query in queries]
+        await asyncio.gather(
+            *[_group_query(filter, indices) for filter, indices in groups.items()]
         )
         return results
 
+    def _get_chunks_from_hits(
+        self, hits, return_from: int
+    ) -> List[DocumentChunkWithScore]:
+        """Convert the hits of one search vector to DocumentChunkWithScores.
+
+        Args:
+            hits: The hits for a single vector of the search.
+            return_from (int): The index of the first schema field that was output.
+
+        Returns:
+            List[DocumentChunkWithScore]: The chunks with their scores.
+        """
+        # Results that will hold our DocumentChunkWithScores
+        results = []
+        # Parse every result for our search
+        for hit in hits:
+            # The distance score for the search result, falls under DocumentChunkWithScore
+            score = hit.score
+            # Our metadata info, falls under DocumentChunkMetadata
+            metadata = {}
+            # Grab the values that correspond to our fields, ignore pk and embedding.
+            for x in [field[0] for field in self._get_schema()[return_from:]]:
+                metadata[x] = hit.entity.get(x)
+            # If the source isn't valid, convert to None
+            if metadata["source"] not in Source.__members__:
+                metadata["source"] = None
+            # Text falls under the DocumentChunk
+            text = metadata.pop("text")
+            # Id falls under the DocumentChunk
+            ids = metadata.pop("id")
+            chunk = DocumentChunkWithScore(
+                id=ids,
+                score=score,
+                text=text,
+                metadata=DocumentChunkMetadata(**metadata),
+            )
+            results.append(chunk)
+
+        # TODO: decide on doing queries to grab the embedding itself, slows down performance as double query occurs
+
+        return results
+
     async def delete(
         self,
         ids: Optional[List[str]] = None,
@@ -489,6 +544,15 @@ class MilvusDataStore(DataStore):
             filter (Optional[DocumentMetadataFilter], optional): The filter to delete by. Defaults to None.
             delete_all (Optional[bool], optional): Whether to drop the collection and recreate it. Defaults to None.
         """
+        # The pymilvus calls are blocking, run them in the thread pool
+        return await asyncio.to_thread(self._delete, ids, filter, delete_all)
+
+    def _delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
         # If deleting all, drop and create the new collection
         if delete_all:
             coll_name = self.col.name
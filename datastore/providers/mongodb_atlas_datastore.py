@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import Dict, List, Any, Optional
 from loguru import logger
@@ -24,6 +25,8 @@ MONGODB_CONNECTION_URI = os.environ.get("MONGODB_URI")
 MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "default")
 MONGODB_COLLECTION = os.environ.get("MONGODB_COLLECTION", "default")
 MONGODB_INDEX = os.environ.get("MONGODB_INDEX", "default")
+MONGODB_UPSERT_BATCH_BYTES = int(os.environ.get("MONGODB_UPSERT_BATCH_BYTES", 8 * 1024 * 1024))
+MONGODB_UPSERT_CONCURRENCY = int(os.environ.get("MONGODB_UPSERT_CONCURRENCY", 4))
 OVERSAMPLING_FACTOR = 10
 MAX_CANDIDATES = 10_000
 
@@ -91,20 +94,53 @@ class MongoDBAtlasDataStore(DataStore):
         Takes in a list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
-        documents_to_upsert = []
+        batches: List[List[UpdateOne]] = [[]]
+        batch_bytes = 0
         inserted_ids = []
         for chunk_list in chunks.values():
             for chunk in chunk_list:
                 inserted_ids.append(chunk.id)
-                documents_to_upsert.append(
-                        UpdateOne({'_id': chunk.id}, {"$set": chunk.dict()}, upsert=True)
+                # the id is already stored as the _id of the document
+                document = chunk.dict(exclude={"id"})
+                # a numeric timestamp, so that the date filters can compare it
+                if chunk.metadata.created_at is not None:
+                    document["created_at"] = to_unix_timestamp(chunk.metadata.created_at)
+                document_bytes = self._get_document_bytes(chunk)
+                # Start a new batch if this document would overflow the current one
+                if batches[-1] and batch_bytes + document_bytes > MONGODB_UPSERT_BATCH_BYTES:
+                    batches.append([])
+                    batch_bytes = 0
+                batches[-1].append(
+                        UpdateOne({'_id': chunk.id}, {"$set": document}, upsert=True)
                 )
+                batch_bytes += document_bytes
+
         logger.info(f"Upsert documents into MongoDB collection: {self.database_name}: {self.collection_name}")
-        await self.client[self.database_name][self.collection_name].bulk_write(documents_to_upsert)
+        collection = self.client[self.database_name][self.collection_name]
+        semaphore = asyncio.Semaphore(MONGODB_UPSERT_CONCURRENCY)
+
+        async def _write_batch(batch: List[UpdateOne]):
+            async with semaphore:
+                # the chunks are independent, an unordered write lets the server apply them in parallel
+                await collection.bulk_write(batch, ordered=False)
+
+        await asyncio.gather(*[_write_batch(batch) for batch in batches if batch])
         logger.info("Upsert successful")
 
         return inserted_ids
 
+    @staticmethod
+    def _get_document_bytes(chunk: DocumentChunk) -> int:
+        """
+        Estimate the BSON size of the document of a chunk in bytes.
+        """
+        # every element of the embedding is stored as a double keyed by its index
+        size = 16 * len(chunk.embedding or [])
+        size += len(chunk.text.encode("utf-8"))
+        for value in chunk.metadata.dict().values():
+            size += len(str(value).encode("utf-8")) + 16
+        return size
+
     async def _query(
         self,
         queries: List[QueryWithEmbedding],
@@ -113,28 +149,33 @@ class MongoDBAtlasDataStore(DataStore):
         Takes in a list of queries with embeddings and filters and returns
         a list of query results with matching document chunks and scores.
         """
-        results = []
-        for query in queries:
-            query_result = await self._execute_embedding_query(query)
-            results.append(query_result)
-
-        return results
+        return await asyncio.gather(
+            *[self._execute_embedding_query(query) for query in queries]
+        )
 
     async def _execute_embedding_query(self, query: QueryWithEmbedding) -> QueryResult:
         """
         Execute a MongoDB query using vector search on the specified collection and
         return the result of the query, including matched documents and their scores.
         """
+        vector_search = {
+            'index': self.index_name,
+            'path': 'embedding',
+            'queryVector': query.embedding,
+            'numCandidates': min(query.top_k * self.oversampling_factor, MAX_CANDIDATES),
+            'limit': query.top_k
+        }
+        # pre-filter, so that only the matching vectors are searched.
+        # The filtered fields must be indexed as filter fields of the vector search index
+        mongo_filter = self._build_mongo_filter(query.filter)
+        if mongo_filter.get("$and"):
+            vector_search['filter'] = mongo_filter
+
         pipeline = [
             {
-                '$vectorSearch': {
-                    'index': self.index_name,
-                    'path': 'embedding',
-                    'queryVector': query.embedding,
-                    'numCandidates': min(query.top_k * self.oversampling_factor, MAX_CANDIDATES),
-                    'limit': query.top_k
-                 }
+                '$vectorSearch': vector_search
             }, {
+                # an inclusion projection, the embedding never leaves the server
                 '$project': {
                     'text': 1,
                     'metadata': 1,
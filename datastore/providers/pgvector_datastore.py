@@ -1,10 +1,14 @@
+import asyncio
+import math
+import os
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 from loguru import logger
 
 from services.date import to_unix_timestamp
-from datastore.datastore import DataStore
+from datastore.datastore import DataStore, get_search_width
 from models.models import (
     DocumentChunk,
     DocumentChunkMetadata,
@@ -14,6 +18,28 @@ from models.models import (
     DocumentChunkWithScore,
 )
 
+UPSERT_BATCH_SIZE = int(os.environ.get("PG_UPSERT_BATCH_SIZE", 500))
+
+# vector index managed by the datastore, either hnsw or ivfflat (no index is managed if unset)
+PG_INDEX_TYPE = os.environ.get("PG_INDEX_TYPE")
+assert PG_INDEX_TYPE in (None, "hnsw", "ivfflat")
+PG_HNSW_M = int(os.environ.get("PG_HNSW_M", 16))
+PG_HNSW_EF_CONSTRUCTION = int(os.environ.get("PG_HNSW_EF_CONSTRUCTION", 64))
+# derived from the number of rows if unset
+PG_IVFFLAT_LISTS = os.environ.get("PG_IVFFLAT_LISTS")
+# rebuild the index once the table has grown by this factor since it was built
+PG_INDEX_REBUILD_THRESHOLD = float(os.environ.get("PG_INDEX_REBUILD_THRESHOLD", 2))
+# minimum seconds between two checks of the threshold after upserts
+PG_INDEX_REBUILD_CHECK_INTERVAL = float(
+    os.environ.get("PG_INDEX_REBUILD_CHECK_INTERVAL", 60)
+)
+# default target recall for queries that don't set one
+PG_INDEX_RECALL = os.environ.get("PG_INDEX_RECALL")
+
+# pgvector defaults and limits for the search parameters
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+
 
 # interface for Postgres client to implement pg based Datastore providers
 class PGClient(ABC):
@@ -24,6 +50,22 @@ class PGClient(ABC):
         """
         raise NotImplementedError
 
+    async def upsert_many(self, table: str, rows: List[dict[str, Any]]) -> None:
+        """
+        Takes in a batch of documents and inserts them into the table.
+        Clients should override this to write the whole batch in a single transaction.
+        """
+        for json in rows:
+            await self.upsert(table, json)
+
+    async def get_vector_index(
+        self, table: str, column: str
+    ) -> Optional[Tuple[str, dict[str, int]]]:
+        """
+        Returns the type and parameters of the vector index on the column, or None if there is none.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     async def rpc(self, function_name: str, params: dict[str, Any]) -> Any:
         """
@@ -31,6 +73,41 @@ class PGClient(ABC):
         """
         raise NotImplementedError
 
+    async def rpc_many(
+        self,
+        function_name: str,
+        params_list: List[dict[str, Any]],
+        settings: Optional[dict[str, Any]] = None,
+    ) -> List[Any]:
+        """
+        Calls a stored procedure once per parameter set and returns the results in the same order.
+        Settings are configuration parameters to apply for the calls, clients that can't set them may ignore them.
+        Clients should override this to send all the calls in a single round trip.
+        """
+        return await asyncio.gather(
+            *[self.rpc(function_name, params=params) for params in params_list]
+        )
+
+    async def count(self, table: str) -> int:
+        """
+        Returns the number of rows in the table.
+        """
+        raise NotImplementedError
+
+    async def create_vector_index(
+        self,
+        table: str,
+        column: str,
+        index_type: str,
+        index_params: dict[str, int],
+        replace: bool = False,
+    ) -> None:
+        """
+        Creates the vector index on the column if it doesn't exist or doesn't match the type and parameters.
+        If replace is set, the index is rebuilt even if it matches.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     async def delete_like(self, table: str, column: str, pattern: str) -> None:
         """
@@ -59,22 +136,174 @@ class PGClient(ABC):
 class PgVectorDataStore(DataStore):
     def __init__(self):
         self.client = self.create_db_client()
+        self._index_params: dict[str, int] = {}
+        self._indexed_row_count = 0
+        self._rebuild_checked_at: Optional[float] = None
+        self._rebuild_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def init(cls):
+        """
+        Create the datastore and set up the vector index if one is configured.
+        """
+        datastore = cls()
+        if PG_INDEX_TYPE:
+            await datastore.ensure_index()
+        return datastore
 
     @abstractmethod
     def create_db_client(self) -> PGClient:
         """
         Create db client, can be accessing postgres database via different APIs.
-        Can be supabase client or psycopg2 based client.
+        Can be supabase client or psycopg based client.
         Return a client for postgres DB.
         """
 
         raise NotImplementedError
 
+    def _get_index_params(self, row_count: int) -> dict[str, int]:
+        if PG_INDEX_TYPE == "hnsw":
+            return {"m": PG_HNSW_M, "ef_construction": PG_HNSW_EF_CONSTRUCTION}
+        if PG_IVFFLAT_LISTS:
+            return {"lists": int(PG_IVFFLAT_LISTS)}
+        # rows / 1000 for up to 1M rows and sqrt(rows) above, as recommended by pgvector
+        if row_count <= 1_000_000:
+            lists = row_count // 1000
+        else:
+            lists = int(math.sqrt(row_count))
+        return {"lists": max(lists, 1)}
+
+    def _get_built_row_count(self, index_params: dict[str, int]) -> Optional[int]:
+        """
+        Returns the number of rows an IVFFlat index with these lists was sized for, the inverse of _get_index_params.
+        """
+        lists = index_params.get("lists")
+        if lists is None:
+            return None
+        return lists * 1000 if lists <= 1000 else lists**2
+
+    async def ensure_index(self) -> None:
+        """
+        Creates the vector index if it doesn't exist, or recreates it if its type or configured parameters changed.
+        An IVFFlat index with derived lists is kept as it is, it only grows through rebuild_index.
+        """
+        existing = await self.client.get_vector_index("documents", "embedding")
+        row_count = await self.client.count("documents")
+        if existing is not None and existing[0] == PG_INDEX_TYPE:
+            index_params = existing[1]
+            expected_params = (
+                self._get_index_params(row_count)
+                if PG_INDEX_TYPE == "hnsw" or PG_IVFFLAT_LISTS
+                else index_params
+            )
+            if index_params == expected_params:
+                self._set_index_params(index_params, row_count)
+                logger.info(f"Keeping {PG_INDEX_TYPE} index with {index_params}")
+                return
+
+        index_params = self._get_index_params(row_count)
+        logger.info(f"Creating {PG_INDEX_TYPE} index with {index_params}")
+        await self.client.create_vector_index(
+            "documents", "embedding", PG_INDEX_TYPE, index_params
+        )
+        self._set_index_params(index_params, row_count)
+
+    def _set_index_params(self, index_params: dict[str, int], row_count: int) -> None:
+        self._index_params = index_params
+        # the growth is measured from the size the lists are derived for, so a small table
+        # isn't rebuilt until its lists would change
+        built_row_count = self._get_built_row_count(index_params)
+        self._indexed_row_count = (
+            row_count if built_row_count is None else built_row_count
+        )
+
+    async def rebuild_index(self, force: bool = False) -> bool:
+        """
+        Rebuilds the vector index once the table has grown past PG_INDEX_REBUILD_THRESHOLD times
+        the size its lists were derived for, or unconditionally if force is set. Called in the
+        background after upserts, see _schedule_rebuild_check.
+        Only IVFFlat indexes with derived lists are rebuilt on growth, the other parameters don't depend on the rows.
+        Returns whether the index was rebuilt.
+        """
+        if not PG_INDEX_TYPE:
+            return False
+        if not force and (PG_INDEX_TYPE == "hnsw" or PG_IVFFLAT_LISTS):
+            return False
+        row_count = await self.client.count("documents")
+        if (
+            not force
+            and row_count < max(self._indexed_row_count, 1) * PG_INDEX_REBUILD_THRESHOLD
+        ):
+            return False
+        index_params = self._get_index_params(row_count)
+        logger.info(
+            f"Rebuilding {PG_INDEX_TYPE} index for {row_count} rows with {index_params}"
+        )
+        await self.client.create_vector_index(
+            "documents", "embedding", PG_INDEX_TYPE, index_params, replace=True
+        )
+        self._set_index_params(index_params, row_count)
+        return True
+
+    def _schedule_rebuild_check(self) -> None:
+        """
+        Checks the rebuild threshold in the background, at most once per PG_INDEX_REBUILD_CHECK_INTERVAL.
+        """
+        # only IVFFlat indexes with derived lists are rebuilt on growth, the count can be skipped otherwise
+        if PG_INDEX_TYPE != "ivfflat" or PG_IVFFLAT_LISTS:
+            return
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            return
+        now = time.monotonic()
+        if (
+            self._rebuild_checked_at is not None
+            and now - self._rebuild_checked_at < PG_INDEX_REBUILD_CHECK_INTERVAL
+        ):
+            return
+        self._rebuild_checked_at = now
+        self._rebuild_task = asyncio.create_task(self._rebuild_in_background())
+
+    async def _rebuild_in_background(self) -> None:
+        try:
+            await self.rebuild_index()
+        except Exception as e:
+            logger.error(f"Failed to rebuild the {PG_INDEX_TYPE} index: {e}")
+
+    async def close(self) -> None:
+        # a rebuild is a single transaction, so a cancelled one leaves the previous index in place
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            self._rebuild_task = None
+
+    def _get_search_settings(self, queries: List[QueryWithEmbedding]) -> dict[str, Any]:
+        """
+        Maps the requested recall to the index search parameter.
+        All the queries run in one statement, so the highest requested recall is used.
+        """
+        recalls = [query.recall for query in queries if query.recall is not None]
+        if not recalls and PG_INDEX_RECALL:
+            recalls = [float(PG_INDEX_RECALL)]
+        if not PG_INDEX_TYPE or not recalls:
+            return {}
+        recall = max(recalls)
+        top_k = max(query.top_k or 0 for query in queries)
+        # a recall of 0.9 uses the pgvector default ef_search for HNSW, and sqrt(lists) probes
+        # for IVFFlat, as recommended by pgvector, rather than its default of a single probe
+        if PG_INDEX_TYPE == "hnsw":
+            ef_search = get_search_width(
+                HNSW_DEFAULT_EF_SEARCH, recall, top_k, HNSW_MAX_EF_SEARCH
+            )
+            return {"hnsw.ef_search": ef_search}
+        lists = self._index_params.get("lists", 1)
+        probes = get_search_width(math.sqrt(lists), recall, 1, lists)
+        return {"ivfflat.probes": probes}
+
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
         Takes in a dict of document_ids to list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
+        rows: List[dict[str, Any]] = []
         for document_id, document_chunks in chunks.items():
             for chunk in document_chunks:
                 json = {
@@ -88,20 +317,23 @@ class PgVectorDataStore(DataStore):
                     "author": chunk.metadata.author,
                 }
                 if chunk.metadata.created_at:
-                    json["created_at"] = (
-                        datetime.fromtimestamp(
-                            to_unix_timestamp(chunk.metadata.created_at)
-                        ),
+                    json["created_at"] = datetime.fromtimestamp(
+                        to_unix_timestamp(chunk.metadata.created_at)
                     )
-                await self.client.upsert("documents", json)
+                rows.append(json)
 
+        # write the chunks in batches, one transaction per batch
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            await self.client.upsert_many("documents", rows[i : i + UPSERT_BATCH_SIZE])
+
+        self._schedule_rebuild_check()
         return list(chunks.keys())
 
     async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
-        query_results: List[QueryResult] = []
+        params_list: List[dict[str, Any]] = []
         for query in queries:
             # get the top 3 documents with the highest cosine similarity using rpc function in the database called "match_page_sections"
             params = {
@@ -126,30 +358,40 @@ class PgVectorDataStore(DataStore):
                     params["in_end_date"] = datetime.fromtimestamp(
                         to_unix_timestamp(query.filter.end_date)
                     )
-            try:
-                data = await self.client.rpc("match_page_sections", params=params)
-                results: List[DocumentChunkWithScore] = []
-                for row in data:
-                    document_chunk = DocumentChunkWithScore(
-                        id=row["id"],
-                        text=row["content"],
-                        # TODO: add embedding to the response ?
-                        # embedding=row["embedding"],
-                        score=float(row["similarity"]),
-                        metadata=DocumentChunkMetadata(
-                            source=row["source"],
-                            source_id=row["source_id"],
-                            document_id=row["document_id"],
-                            url=row["url"],
-                            created_at=row["created_at"],
-                            author=row["author"],
-                        ),
-                    )
-                    results.append(document_chunk)
-                query_results.append(QueryResult(query=query.query, results=results))
-            except Exception as e:
-                logger.error(e)
-                query_results.append(QueryResult(query=query.query, results=[]))
+            params_list.append(params)
+
+        try:
+            # run every query of the request in a single call to the database
+            data_list = await self.client.rpc_many(
+                "match_page_sections",
+                params_list=params_list,
+                settings=self._get_search_settings(queries),
+            )
+        except Exception as e:
+            logger.error(e)
+            return [QueryResult(query=query.query, results=[]) for query in queries]
+
+        query_results: List[QueryResult] = []
+        for query, data in zip(queries, data_list):
+            results: List[DocumentChunkWithScore] = []
+            for row in data:
+                document_chunk = DocumentChunkWithScore(
+                    id=row["id"],
+                    text=row["content"],
+                    # TODO: add embedding to the response ?
+                    # embedding=row["embedding"],
+                    score=float(row["similarity"]),
+                    metadata=DocumentChunkMetadata(
+                        source=row["source"],
+                        source_id=row["source_id"],
+                        document_id=row["document_id"],
+                        url=row["url"],
+                        created_at=row["created_at"],
+                        author=row["author"],
+                    ),
+                )
+                results.append(document_chunk)
+            query_results.append(QueryResult(query=query.query, results=results))
         return query_results
 
     async def delete(
@@ -1,11 +1,14 @@
+import asyncio
 import os
-from typing import Any, List
+from typing import Any, List, Optional, Tuple
 from datetime import datetime
 import numpy as np
 
-from psycopg2 import connect
-from psycopg2.extras import DictCursor
-from pgvector.psycopg2 import register_vector
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from pgvector.psycopg import register_vector_async
 
 from services.date import to_unix_timestamp
 from datastore.providers.pgvector_datastore import PGClient, PgVectorDataStore
@@ -18,6 +21,8 @@ PG_PORT = int(os.environ.get("PG_PORT", 5432))
 PG_DB = os.environ.get("PG_DB", "postgres")
 PG_USER = os.environ.get("PG_USER", "postgres")
 PG_PASSWORD = os.environ.get("PG_PASSWORD", "postgres")
+PG_POOL_MIN_SIZE = int(os.environ.get("PG_POOL_MIN_SIZE", 1))
+PG_POOL_MAX_SIZE = int(os.environ.get("PG_POOL_MAX_SIZE", 10))
 
 
 # class that implements the DataStore interface for Postgres Datastore provider
@@ -29,46 +34,75 @@ class PostgresDataStore(PgVectorDataStore):
 class PostgresClient(PGClient):
     def __init__(self) -> None:
         super().__init__()
-        self.client = connect(
-            dbname=PG_DB, user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT
+        # the pool is opened lazily as it needs a running event loop
+        self.pool = AsyncConnectionPool(
+            make_conninfo(
+                dbname=PG_DB,
+                user=PG_USER,
+                password=PG_PASSWORD,
+                host=PG_HOST,
+                port=PG_PORT,
+            ),
+            min_size=PG_POOL_MIN_SIZE,
+            max_size=PG_POOL_MAX_SIZE,
+            configure=register_vector_async,
+            open=False,
         )
-        register_vector(self.client)
+        self._pool_lock = asyncio.Lock()
+        self._pool_opened = False
 
-    def __del__(self):
-        # close the connection when the client is destroyed
-        self.client.close()
+    async def _get_pool(self) -> AsyncConnectionPool:
+        if not self._pool_opened:
+            async with self._pool_lock:
+                if not self._pool_opened:
+                    await self.pool.open()
+                    self._pool_opened = True
+        return self.pool
+
+    async def close(self):
+        """
+        Closes all the connections of the pool.
+        """
+        if self._pool_opened:
+            await self.pool.close()
+            self._pool_opened = False
 
     async def upsert(self, table: str, json: dict[str, Any]):
         """
         Takes in a list of documents and inserts them into the table.
         """
-        with self.client.cursor() as cur:
-            if not json.get("created_at"):
-                json["created_at"] = datetime.now()
-            json["embedding"] = np.array(json["embedding"])
-            cur.execute(
-                f"INSERT INTO {table} (id, content, embedding, document_id, source, source_id, url, author, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET content = %s, embedding = %s, document_id = %s, source = %s, source_id = %s, url = %s, author = %s, created_at = %s",
-                (
-                    json["id"],
-                    json["content"],
-                    json["embedding"],
-                    json["document_id"],
-                    json["source"],
-                    json["source_id"],
-                    json["url"],
-                    json["author"],
-                    json["created_at"],
-                    json["content"],
-                    json["embedding"],
-                    json["document_id"],
-                    json["source"],
-                    json["source_id"],
-                    json["url"],
-                    json["author"],
-                    json["created_at"],
-                ),
+        await self.upsert_many(table, [json])
+
+    async def upsert_many(self, table: str, rows: List[dict[str, Any]]):
+        """
+        Takes in a batch of documents and inserts them into the table in a single transaction.
+        """
+        values = [
+            (
+                json["id"],
+                json["content"],
+                np.array(json["embedding"]),
+                json["document_id"],
+                json["source"],
+                json["source_id"],
+                json["url"],
+                json["author"],
+                json.get("created_at") or datetime.now(),
             )
-            self.client.commit()
+            for json in rows
+        ]
+        if not values:
+            return
+        pool = await self._get_pool()
+        # the connection commits the transaction when it goes back to the pool
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(
+                    sql.SQL(
+                        "INSERT INTO {} (id, content, embedding, document_id, source, source_id, url, author, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET content = EXCLUDED.content, embedding = EXCLUDED.embedding, document_id = EXCLUDED.document_id, source = EXCLUDED.source, source_id = EXCLUDED.source_id, url = EXCLUDED.url, author = EXCLUDED.author, created_at = EXCLUDED.created_at"
+                    ).format(sql.Identifier(table)),
+                    values,
+                )
 
     async def rpc(self, function_name: str, params: dict[str, Any]):
         """
@@ -76,57 +110,231 @@ class PostgresClient(PGClient):
         """
         data = []
         params["in_embedding"] = np.array(params["in_embedding"])
-        with self.client.cursor(cursor_factory=DictCursor) as cur:
-            cur.callproc(function_name, params)
-            rows = cur.fetchall()
-            self.client.commit()
-            for row in rows:
-                row["created_at"] = to_unix_timestamp(row["created_at"])
-                data.append(dict(row))
+        arguments = sql.SQL(", ").join(
+            sql.SQL("{} => {}").format(sql.Identifier(name), sql.Placeholder(name))
+            for name in params
+        )
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(
+                    sql.SQL("SELECT * FROM {}({})").format(
+                        sql.Identifier(function_name), arguments
+                    ),
+                    params,
+                )
+                rows = await cur.fetchall()
+        for row in rows:
+            row["created_at"] = to_unix_timestamp(row["created_at"])
+            data.append(row)
         return data
 
+    async def rpc_many(
+        self,
+        function_name: str,
+        params_list: List[dict[str, Any]],
+        settings: Optional[dict[str, Any]] = None,
+    ):
+        """
+        Calls a stored procedure once per parameter set in a single statement and returns the results in the same order.
+        Settings are applied for the transaction of the statement only.
+        """
+        if not params_list:
+            return []
+        statements = []
+        values: List[Any] = []
+        for query_index, params in enumerate(params_list):
+            params["in_embedding"] = np.array(params["in_embedding"])
+            arguments = sql.SQL(", ").join(
+                sql.SQL("{} => %s").format(sql.Identifier(name)) for name in params
+            )
+            statements.append(
+                sql.SQL("SELECT {} AS query_index, * FROM {}({})").format(
+                    sql.Literal(query_index), sql.Identifier(function_name), arguments
+                )
+            )
+            values.extend(params.values())
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                for name, value in (settings or {}).items():
+                    await cur.execute(
+                        "SELECT set_config(%s, %s, true)", (name, str(value))
+                    )
+                await cur.execute(sql.SQL(" UNION ALL ").join(statements), values)
+                rows = await cur.fetchall()
+
+        data: List[List[dict[str, Any]]] = [[] for _ in params_list]
+        for row in rows:
+            row["created_at"] = to_unix_timestamp(row["created_at"])
+            data[row.pop("query_index")].append(row)
+        # UNION ALL doesn't guarantee the order of each branch is kept
+        for query_rows in data:
+            query_rows.sort(key=lambda row: row["similarity"], reverse=True)
+        return data
+
+    async def count(self, table: str) -> int:
+        """
+        Returns the number of rows in the table.
+        """
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute(
+                sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table))
+            )
+            row = await cur.fetchone()
+        return row[0]
+
+    async def _get_vector_indexes(
+        self, conn, table: str, column: str
+    ) -> List[Tuple[str, str, List[str]]]:
+        """
+        Returns the name, access method and options of every vector index on the column, whatever its name,
+        so indexes created by hand, such as the unnamed documents_embedding_idx, are found too.
+        The index managed by the datastore comes first.
+        """
+        cur = await conn.execute(
+            "SELECT c.relname, am.amname, c.reloptions FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "JOIN pg_am am ON am.oid = c.relam "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] "
+            "WHERE i.indrelid = %s::regclass AND a.attname = %s AND am.amname IN ('hnsw', 'ivfflat') "
+            "ORDER BY c.relname = %s DESC, c.relname",
+            (table, column, f"ix_{table}_{column}"),
+        )
+        return [(row[0], row[1], row[2] or []) for row in await cur.fetchall()]
+
+    async def get_vector_index(
+        self, table: str, column: str
+    ) -> Optional[Tuple[str, dict[str, int]]]:
+        """
+        Returns the type and parameters of the vector index on the column, or None if there is none.
+        """
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            existing = await self._get_vector_indexes(conn, table, column)
+        if not existing:
+            return None
+        _, index_type, options = existing[0]
+        index_params = {}
+        for option in options:
+            name, value = option.split("=", 1)
+            index_params[name] = int(value)
+        return index_type, index_params
+
+    async def create_vector_index(
+        self,
+        table: str,
+        column: str,
+        index_type: str,
+        index_params: dict[str, int],
+        replace: bool = False,
+    ):
+        """
+        Creates the vector index on the column if it doesn't exist or doesn't match the type and parameters.
+        If replace is set, the index is rebuilt even if it matches.
+        The other vector indexes on the column are dropped, so the table never has two of them.
+        """
+        index_name = f"ix_{table}_{column}"
+        # the datastore searches by inner product
+        definition = sql.SQL(
+            "CREATE INDEX {} ON {} USING {} ({} vector_ip_ops) WITH ({})"
+        ).format(
+            sql.Identifier(index_name),
+            sql.Identifier(table),
+            sql.SQL(index_type),
+            sql.Identifier(column),
+            sql.SQL(", ").join(
+                sql.SQL("{} = {}").format(sql.SQL(name), sql.Literal(int(value)))
+                for name, value in index_params.items()
+            ),
+        )
+        expected_options = sorted(
+            f"{name}={value}" for name, value in index_params.items()
+        )
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            existing = await self._get_vector_indexes(conn, table, column)
+            if (
+                len(existing) == 1
+                and not replace
+                and existing[0][1] == index_type
+                and sorted(existing[0][2]) == expected_options
+            ):
+                return
+            # build and swap in a single transaction so the table is never left without an index
+            stale_names = [name for name, _, _ in existing]
+            if index_name in stale_names:
+                await conn.execute(
+                    sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        sql.Identifier(index_name), sql.Identifier(f"{index_name}_old")
+                    )
+                )
+                stale_names[stale_names.index(index_name)] = f"{index_name}_old"
+            await conn.execute(definition)
+            for name in stale_names:
+                await conn.execute(
+                    sql.SQL("DROP INDEX {}").format(sql.Identifier(name))
+                )
+
     async def delete_like(self, table: str, column: str, pattern: str):
         """
         Deletes rows in the table that match the pattern.
         """
-        with self.client.cursor() as cur:
-            cur.execute(
-                f"DELETE FROM {table} WHERE {column} LIKE %s",
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            await conn.execute(
+                sql.SQL("DELETE FROM {} WHERE {} LIKE %s").format(
+                    sql.Identifier(table), sql.Identifier(column)
+                ),
                 (f"%{pattern}%",),
             )
-            self.client.commit()
 
     async def delete_in(self, table: str, column: str, ids: List[str]):
         """
         Deletes rows in the table that match the ids.
         """
-        with self.client.cursor() as cur:
-            cur.execute(
-                f"DELETE FROM {table} WHERE {column} IN %s",
-                (tuple(ids),),
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            await conn.execute(
+                sql.SQL("DELETE FROM {} WHERE {} = ANY(%s)").format(
+                    sql.Identifier(table), sql.Identifier(column)
+                ),
+                (list(ids),),
             )
-            self.client.commit()
 
     async def delete_by_filters(self, table: str, filter: DocumentMetadataFilter):
         """
         Deletes rows in the table that match the filter.
         """
 
-        filters = "WHERE"
+        conditions = []
+        params = []
         if filter.document_id:
-            filters += f" document_id = '{filter.document_id}' AND"
+            conditions.append("document_id = %s")
+            params.append(filter.document_id)
         if filter.source:
-            filters += f" source = '{filter.source}' AND"
+            conditions.append("source = %s")
+            params.append(filter.source.value)
         if filter.source_id:
-            filters += f" source_id = '{filter.source_id}' AND"
+            conditions.append("source_id = %s")
+            params.append(filter.source_id)
         if filter.author:
-            filters += f" author = '{filter.author}' AND"
+            conditions.append("author = %s")
+            params.append(filter.author)
         if filter.start_date:
-            filters += f" created_at >= '{filter.start_date}' AND"
+            conditions.append("created_at >= %s")
+            params.append(filter.start_date)
         if filter.end_date:
-            filters += f" created_at <= '{filter.end_date}' AND"
-        filters = filters[:-4]
+            conditions.append("created_at <= %s")
+            params.append(filter.end_date)
+        if not conditions:
+            return
 
-        with self.client.cursor() as cur:
-            cur.execute(f"DELETE FROM {table} {filters}")
-            self.client.commit()
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            await conn.execute(
+                sql.SQL("DELETE FROM {} WHERE ").format(sql.Identifier(table))
+                + sql.SQL(" AND ".join(conditions)),
+                params,
+            )
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import uuid
 from typing import Dict, List, Optional
@@ -26,8 +27,21 @@ QDRANT_GRPC_PORT = os.environ.get("QDRANT_GRPC_PORT", "6334")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
 QDRANT_COLLECTION = os.environ.get("QDRANT_COLLECTION", "document_chunks")
 
+QDRANT_UPSERT_BATCH_SIZE = int(os.environ.get("QDRANT_UPSERT_BATCH_SIZE", 256))
+QDRANT_UPSERT_CONCURRENCY = int(os.environ.get("QDRANT_UPSERT_CONCURRENCY", 4))
+# wait for the points to be indexed before returning from an upsert
+QDRANT_UPSERT_WAIT = os.environ.get("QDRANT_UPSERT_WAIT", "true").lower() == "true"
+# number of points read per request when looking up the stored chunks of documents
+QDRANT_SCROLL_LIMIT = int(os.environ.get("QDRANT_SCROLL_LIMIT", 1000))
+
 EMBEDDING_DIMENSION = int(os.environ.get("EMBEDDING_DIMENSION", 256))
 
+# payload fields that are indexed, as they are used in filters and deletes
+PAYLOAD_INDEXES = {
+    "metadata.document_id": PayloadSchemaType.KEYWORD,
+    "created_at": PayloadSchemaType.INTEGER,
+}
+
 
 class QdrantDataStore(DataStore):
     UUID_NAMESPACE = uuid.UUID("3896d314-1e95-4a3a-b45a-945f9f0b541d")
@@ -47,7 +61,7 @@ class QdrantDataStore(DataStore):
                 Any of "Cosine" / "Euclid" / "Dot". Distance function to measure
                 similarity
         """
-        self.client = qdrant_client.QdrantClient(
+        client_params = dict(
             url=QDRANT_URL,
             port=int(QDRANT_PORT),
             grpc_port=int(QDRANT_GRPC_PORT),
@@ -55,10 +69,18 @@ class QdrantDataStore(DataStore):
             prefer_grpc=True,
             timeout=10,
         )
+        self.client = qdrant_client.AsyncQdrantClient(**client_params)
         self.collection_name = collection_name or QDRANT_COLLECTION
 
-        # Set up the collection so the points might be inserted or queried
-        self._set_up_collection(vector_size, distance, recreate_collection)
+        # Set up the collection so the points might be inserted or queried. The
+        # constructor can't await, so a short-lived sync client is used for it
+        setup_client = qdrant_client.QdrantClient(**client_params)
+        try:
+            self._set_up_collection(
+                setup_client, vector_size, distance, recreate_collection
+            )
+        finally:
+            setup_client.close()
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
@@ -70,13 +92,70 @@ class QdrantDataStore(DataStore):
             for _, chunks in chunks.items()
             for chunk in chunks
         ]
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=points,  # type: ignore
-            wait=True,
+        semaphore = asyncio.Semaphore(QDRANT_UPSERT_CONCURRENCY)
+
+        async def _upsert_batch(batch: List[rest.PointStruct]):
+            async with semaphore:
+                await self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=batch,
+                    wait=QDRANT_UPSERT_WAIT,
+                )
+
+        await asyncio.gather(
+            *[
+                _upsert_batch(points[i : i + QDRANT_UPSERT_BATCH_SIZE])
+                for i in range(0, len(points), QDRANT_UPSERT_BATCH_SIZE)
+            ]
         )
         return list(chunks.keys())
 
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Optional[str]]]]:
+        """
+        Returns the content hash of each stored chunk by chunk id, for each of the documents.
+        """
+        hashes: Dict[str, Dict[str, Optional[str]]] = {id_: {} for id_ in document_ids}
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=rest.Filter(
+                    must=[
+                        rest.FieldCondition(
+                            key="metadata.document_id",
+                            match=rest.MatchAny(any=document_ids),
+                        )
+                    ]
+                ),
+                limit=QDRANT_SCROLL_LIMIT,
+                offset=offset,
+                with_payload=["id", "metadata", "content_hash"],
+                with_vectors=False,
+            )
+            for record in records:
+                payload = record.payload or {}
+                metadata = payload.get("metadata") or {}
+                hashes[metadata["document_id"]][payload["id"]] = payload.get(
+                    "content_hash"
+                )
+            if offset is None:
+                return hashes
+
+    async def _delete_chunks(self, chunk_ids: Dict[str, List[str]]) -> None:
+        await self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=rest.PointIdsList(
+                points=[
+                    self._create_document_chunk_id(id_)
+                    for ids in chunk_ids.values()
+                    for id_ in ids
+                ]
+            ),
+            wait=QDRANT_UPSERT_WAIT,
+        )
+
     async def _query(
         self,
         queries: List[QueryWithEmbedding],
@@ -87,7 +166,7 @@ class QdrantDataStore(DataStore):
         search_requests = [
             self._convert_query_to_search_request(query) for query in queries
         ]
-        results = self.client.search_batch(
+        results = await self.client.search_batch(
             collection_name=self.collection_name,
             requests=search_requests,
         )
@@ -124,7 +203,7 @@ class QdrantDataStore(DataStore):
                 filter, ids
             )
 
-        response = self.client.delete(
+        response = await self.client.delete(
             collection_name=self.collection_name,
             points_selector=points_selector,  # type: ignore
         )
@@ -133,20 +212,23 @@ class QdrantDataStore(DataStore):
     def _convert_document_chunk_to_point(
         self, document_chunk: DocumentChunk
     ) -> rest.PointStruct:
-        created_at = (
-            to_unix_timestamp(document_chunk.metadata.created_at)
-            if document_chunk.metadata.created_at is not None
-            else None
-        )
+        # unset attributes are left out of the payload, they are filled back with
+        # None when the payload is read
+        payload = {
+            "id": document_chunk.id,
+            "text": document_chunk.text,
+            "metadata": document_chunk.metadata.dict(exclude_none=True),
+        }
+        if document_chunk.metadata.created_at is not None:
+            payload["created_at"] = to_unix_timestamp(
+                document_chunk.metadata.created_at
+            )
+        if document_chunk.content_hash is not None:
+            payload["content_hash"] = document_chunk.content_hash
         return rest.PointStruct(
             id=self._create_document_chunk_id(document_chunk.id),
             vector=document_chunk.embedding,  # type: ignore
-            payload={
-                "id": document_chunk.id,
-                "text": document_chunk.text,
-                "metadata": document_chunk.metadata.dict(),
-                "created_at": created_at,
-            },
+            payload=payload,
         )
 
     def _create_document_chunk_id(self, external_id: Optional[str]) -> str:
@@ -243,15 +325,19 @@ class QdrantDataStore(DataStore):
         )
 
     def _set_up_collection(
-        self, vector_size: int, distance: str, recreate_collection: bool
+        self,
+        client: qdrant_client.QdrantClient,
+        vector_size: int,
+        distance: str,
+        recreate_collection: bool,
     ):
         distance = rest.Distance[distance.upper()]
 
         if recreate_collection:
-            self._recreate_collection(distance, vector_size)
+            self._recreate_collection(client, distance, vector_size)
 
         try:
-            collection_info = self.client.get_collection(self.collection_name)
+            collection_info = client.get_collection(self.collection_name)
             current_distance = collection_info.config.params.vectors.distance  # type: ignore
             current_vector_size = collection_info.config.params.vectors.size  # type: ignore
 
@@ -270,11 +356,19 @@ class QdrantDataStore(DataStore):
                     f"If you want to use that collection, but with a different "
                     f"vector size, please set `recreate_collection=True` argument."
                 )
+
+            # collections created before the indexes were introduced don't have them
+            self._create_payload_indexes(client, collection_info.payload_schema)
         except (UnexpectedResponse, _InactiveRpcError):
-            self._recreate_collection(distance, vector_size)
+            self._recreate_collection(client, distance, vector_size)
 
-    def _recreate_collection(self, distance: rest.Distance, vector_size: int):
-        self.client.recreate_collection(
+    def _recreate_collection(
+        self,
+        client: qdrant_client.QdrantClient,
+        distance: rest.Distance,
+        vector_size: int,
+    ):
+        client.recreate_collection(
             self.collection_name,
             vectors_config=rest.VectorParams(
                 size=vector_size,
@@ -282,18 +376,20 @@ class QdrantDataStore(DataStore):
             ),
         )
 
-        # Create the payload index for the document_id metadata attribute, as it is
-        # used to delete the document related entries
-        self.client.create_payload_index(
-            self.collection_name,
-            field_name="metadata.document_id",
-            field_type=PayloadSchemaType.KEYWORD,
-        )
+        self._create_payload_indexes(client, {})
 
-        # Create the payload index for the created_at attribute, to make the lookup
-        # by range filters faster
-        self.client.create_payload_index(
-            self.collection_name,
-            field_name="created_at",
-            field_schema=PayloadSchemaType.INTEGER,
-        )
+    def _create_payload_indexes(
+        self,
+        client: qdrant_client.QdrantClient,
+        payload_schema: Dict[str, rest.PayloadIndexInfo],
+    ):
+        # The document_id metadata attribute is used to delete the document related
+        # entries, and created_at is used by range filters
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            if field_name in payload_schema:
+                continue
+            client.create_payload_index(
+                self.collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
@@ -1,6 +1,6 @@
 import os
 from typing import Any, List
-from datetime import datetime
+from datetime import datetime, timezone
 
 from supabase import Client
 
@@ -38,10 +38,27 @@ class SupabaseClient(PGClient):
         Takes in a list of documents and inserts them into the table.
         """
         if "created_at" in json:
-            json["created_at"] = json["created_at"][0].isoformat()
+            json["created_at"] = json["created_at"].isoformat()
 
         self.client.table(table).upsert(json).execute()
 
+    async def upsert_many(self, table: str, rows: List[dict[str, Any]]):
+        """
+        Takes in a batch of documents and inserts them into the table in a single request.
+        """
+        # a bulk upsert sets the columns missing from a row to null instead of their default,
+        # so every row gets a created_at, as the table default would have set it
+        now = datetime.now(timezone.utc).isoformat()
+        # a row can't be upserted twice in one statement, the last version of a row is kept
+        rows_by_id: dict[str, dict[str, Any]] = {}
+        for json in rows:
+            json["created_at"] = (
+                json["created_at"].isoformat() if "created_at" in json else now
+            )
+            rows_by_id[json["id"]] = json
+
+        self.client.table(table).upsert(list(rows_by_id.values())).execute()
+
     async def rpc(self, function_name: str, params: dict[str, Any]):
         """
         Calls a stored procedure in the database with the given parameters.
@@ -28,6 +28,13 @@ WEAVIATE_BATCH_DYNAMIC = os.environ.get("WEAVIATE_BATCH_DYNAMIC", False)
 WEAVIATE_BATCH_TIMEOUT_RETRIES = int(os.environ.get("WEAVIATE_TIMEOUT_RETRIES", 3))
 WEAVIATE_BATCH_NUM_WORKERS = int(os.environ.get("WEAVIATE_BATCH_NUM_WORKERS", 1))
 
+# weight of the vector search against the keyword search, for queries that don't set one
+WEAVIATE_HYBRID_ALPHA = float(os.environ.get("WEAVIATE_HYBRID_ALPHA", 0.5))
+# fetch the vector of every result and return it as the chunk embedding
+WEAVIATE_INCLUDE_VECTORS = (
+    os.environ.get("WEAVIATE_INCLUDE_VECTORS", "false").lower() == "true"
+)
+
 SCHEMA = {
     "class": WEAVIATE_CLASS,
     "description": "The main class",
@@ -195,48 +202,31 @@ class WeaviateDataStore(DataStore):
 
         async def _single_query(query: QueryWithEmbedding) -> QueryResult:
             logger.debug(f"Query: {query.query}")
-            if not hasattr(query, "filter") or not query.filter:
-                result = (
-                    self.client.query.get(
-                        WEAVIATE_CLASS,
-                        [
-                            "chunk_id",
-                            "document_id",
-                            "text",
-                            "source",
-                            "source_id",
-                            "url",
-                            "created_at",
-                            "author",
-                        ],
-                    )
-                    .with_hybrid(query=query.query, alpha=0.5, vector=query.embedding)
-                    .with_limit(query.top_k)  # type: ignore
-                    .with_additional(["score", "vector"])
-                    .do()
-                )
-            else:
-                filters_ = self.build_filters(query.filter)
-                result = (
-                    self.client.query.get(
-                        WEAVIATE_CLASS,
-                        [
-                            "chunk_id",
-                            "document_id",
-                            "text",
-                            "source",
-                            "source_id",
-                            "url",
-                            "created_at",
-                            "author",
-                        ],
-                    )
-                    .with_hybrid(query=query.query, alpha=0.5, vector=query.embedding)
-                    .with_where(filters_)
-                    .with_limit(query.top_k)  # type: ignore
-                    .with_additional(["score", "vector"])
-                    .do()
+            alpha = query.alpha if query.alpha is not None else WEAVIATE_HYBRID_ALPHA
+            additional = ["score", "vector"] if WEAVIATE_INCLUDE_VECTORS else ["score"]
+            builder = (
+                self.client.query.get(
+                    WEAVIATE_CLASS,
+                    [
+                        "chunk_id",
+                        "document_id",
+                        "text",
+                        "source",
+                        "source_id",
+                        "url",
+                        "created_at",
+                        "author",
+                    ],
                 )
+                .with_hybrid(query=query.query, alpha=alpha, vector=query.embedding)
+                .with_limit(query.top_k)  # type: ignore
+                .with_additional(additional)
+            )
+            if hasattr(query, "filter") and query.filter:
+                builder = builder.with_where(self.build_filters(query.filter))
+
+            # the client is blocking, run the request in a worker thread
+            result = await asyncio.to_thread(builder.do)
 
             query_results: List[DocumentChunkWithScore] = []
             response = result["data"]["Get"][WEAVIATE_CLASS]
@@ -245,7 +235,7 @@ class WeaviateDataStore(DataStore):
                 result = DocumentChunkWithScore(
                     id=resp["chunk_id"],
                     text=resp["text"],
-                    # embedding=resp["_additional"]["vector"],
+                    embedding=resp["_additional"].get("vector"),
                     score=resp["_additional"]["score"],
                     metadata=DocumentChunkMetadata(
                         document_id=resp["document_id"] if resp["document_id"] else "",
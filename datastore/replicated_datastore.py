@@ -0,0 +1,165 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from datastore.datastore import DataStore
+from models.models import (
+    Document,
+    DocumentChunk,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+# Weight of the latest latency in the moving average used to pick a replica
+REPLICA_EWMA_ALPHA = float(os.environ.get("REPLICA_EWMA_ALPHA", 0.3))
+# Number of recent latencies of a replica its p95 is computed from
+REPLICA_LATENCY_WINDOW = int(os.environ.get("REPLICA_LATENCY_WINDOW", 200))
+# Delay in seconds before hedging a query, until a replica has enough latencies for a p95
+REPLICA_HEDGE_DELAY = float(os.environ.get("REPLICA_HEDGE_DELAY", 0.5))
+# Latency in seconds a failed query counts as in the moving average
+REPLICA_FAILURE_LATENCY = float(os.environ.get("REPLICA_FAILURE_LATENCY", 10))
+
+# a p95 isn't meaningful with fewer latencies
+MIN_HEDGE_SAMPLES = 20
+
+
+class ReplicaStats:
+    """
+    Tracks the latency of the queries sent to a replica.
+    """
+
+    def __init__(self):
+        # untried replicas are preferred
+        self.ewma = 0.0
+        self.latencies: deque = deque(maxlen=REPLICA_LATENCY_WINDOW)
+
+    def record(self, latency: float, completed: bool = True):
+        """
+        Records the latency of a query. Queries that didn't complete only update the moving average,
+        as their latency is a lower bound.
+        """
+        self.ewma += REPLICA_EWMA_ALPHA * (latency - self.ewma)
+        if completed:
+            self.latencies.append(latency)
+
+    def hedge_delay(self) -> float:
+        """
+        Returns the p95 of the recent latencies, or REPLICA_HEDGE_DELAY until there are enough of them.
+        """
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return REPLICA_HEDGE_DELAY
+        latencies = sorted(self.latencies)
+        return latencies[math.ceil(0.95 * len(latencies)) - 1]
+
+
+class ReplicatedDataStore(DataStore):
+    """
+    Sends the writes to a primary datastore and spreads the queries over its replicas.
+    A query goes to the replica with the lowest moving average latency. If it takes longer than
+    the p95 latency of that replica, the query is also sent to the next replica and the first
+    result is used. A query failing on a replica is retried on the next one.
+    """
+
+    def __init__(self, primary: DataStore, replicas: Optional[List[DataStore]] = None):
+        self.primary = primary
+        self.replicas = replicas or [primary]
+        self._stats = [ReplicaStats() for _ in self.replicas]
+
+    async def upsert(
+        self, documents: List[Document], chunk_token_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Takes in a list of documents and inserts them into the primary.
+        Return a list of document ids.
+        """
+        return await self.primary.upsert(documents, chunk_token_size)
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of document chunks and inserts them into the primary.
+        Return a list of document ids.
+        """
+        return await self.primary._upsert(chunks)
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results from the fastest replica.
+        At most two replicas are queried at once, the first error is raised if every replica fails.
+        """
+        order = sorted(
+            range(len(self.replicas)), key=lambda index: self._stats[index].ewma
+        )
+        pending: Dict[asyncio.Task, int] = {}
+        errors: List[BaseException] = []
+
+        def send_next():
+            index = order[len(pending) + len(errors)]
+            pending[asyncio.create_task(self._query_replica(index, queries))] = index
+
+        def can_send() -> bool:
+            return len(pending) + len(errors) < len(order)
+
+        send_next()
+        try:
+            while pending:
+                timeout = None
+                if len(pending) == 1 and can_send():
+                    (index,) = pending.values()
+                    timeout = self._stats[index].hedge_delay()
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # hedge the query as the replica is slower than usual
+                    send_next()
+                    continue
+                for task in done:
+                    del pending[task]
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    errors.append(error)
+                if not pending and can_send():
+                    send_next()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise errors[0]
+
+    async def _query_replica(
+        self, index: int, queries: List[QueryWithEmbedding]
+    ) -> List[QueryResult]:
+        stats = self._stats[index]
+        start = time.monotonic()
+        try:
+            results = await self.replicas[index]._query(queries)
+        except asyncio.CancelledError:
+            stats.record(time.monotonic() - start, completed=False)
+            raise
+        except Exception:
+            stats.record(REPLICA_FAILURE_LATENCY, completed=False)
+            raise
+        stats.record(time.monotonic() - start)
+        return results
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the primary.
+        Returns whether the operation was successful.
+        """
+        return await self.primary.delete(ids=ids, filter=filter, delete_all=delete_all)
+
+    async def close(self) -> None:
+        # the primary can also be one of the replicas
+        datastores = {id(datastore): datastore for datastore in self.replicas}
+        datastores[id(self.primary)] = self.primary
+        await asyncio.gather(*[datastore.close() for datastore in datastores.values()])
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+from typing import Dict, List, Optional
+
+from datastore.datastore import DataStore
+from models.models import (
+    DEFAULT_TOP_K,
+    DocumentChunk,
+    DocumentChunkWithScore,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+
+class ShardedDataStore(DataStore):
+    """
+    Spreads one logical collection over several datastores.
+    Documents are routed to a shard by a hash of their document id, so the list of shards
+    must keep the same length and order for the documents to be found again.
+    Each shard must store its chunks in a separate index or collection, and the shards
+    must return comparable scores, where a higher score is a better match.
+    """
+
+    def __init__(self, shards: List[DataStore]):
+        if not shards:
+            raise ValueError("ShardedDataStore needs at least one shard")
+        self.shards = shards
+
+    def _get_shard_index(self, document_id: str) -> int:
+        # the built-in hash of a str is salted per process, so it can't be used for routing
+        digest = hashlib.blake2b(document_id.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % len(self.shards)
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of document chunks and inserts them into the shards owning their documents.
+        Return a list of document ids.
+        """
+        shard_chunks: Dict[int, Dict[str, List[DocumentChunk]]] = {}
+        for document_id, document_chunks in chunks.items():
+            shard_chunks.setdefault(self._get_shard_index(document_id), {})[
+                document_id
+            ] = document_chunks
+
+        results = await asyncio.gather(
+            *[
+                self.shards[index]._upsert(chunks_of_shard)
+                for index, chunks_of_shard in shard_chunks.items()
+            ]
+        )
+        return [document_id for ids in results for document_id in ids]
+
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Optional[str]]]]:
+        """
+        Returns the content hash of each stored chunk by chunk id from the shards owning the documents,
+        or None if one of them can't return them.
+        """
+        shard_document_ids: Dict[int, List[str]] = {}
+        for document_id in document_ids:
+            shard_document_ids.setdefault(
+                self._get_shard_index(document_id), []
+            ).append(document_id)
+
+        results = await asyncio.gather(
+            *[
+                self.shards[index]._get_chunk_hashes(ids)
+                for index, ids in shard_document_ids.items()
+            ]
+        )
+        if any(hashes is None for hashes in results):
+            return None
+        return {
+            document_id: chunk_hashes
+            for hashes in results
+            for document_id, chunk_hashes in hashes.items()  # type: ignore
+        }
+
+    async def _delete_chunks(self, chunk_ids: Dict[str, List[str]]) -> None:
+        """
+        Removes the chunks from the shards owning their documents.
+        """
+        shard_chunk_ids: Dict[int, Dict[str, List[str]]] = {}
+        for document_id, ids in chunk_ids.items():
+            shard_chunk_ids.setdefault(self._get_shard_index(document_id), {})[
+                document_id
+            ] = ids
+
+        await asyncio.gather(
+            *[
+                self.shards[index]._delete_chunks(ids_of_shard)
+                for index, ids_of_shard in shard_chunk_ids.items()
+            ]
+        )
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Sends every query to the shards that may hold its results concurrently and merges their top_k results by score.
+        Queries filtered on a document id only go to the shard owning the document.
+        """
+        # the shards must return as many results as are merged
+        queries = [
+            (
+                query
+                if query.top_k is not None
+                else query.copy(update={"top_k": DEFAULT_TOP_K})
+            )
+            for query in queries
+        ]
+        shard_queries: Dict[int, List[int]] = {}
+        for i, query in enumerate(queries):
+            if query.filter and query.filter.document_id:
+                indices = [self._get_shard_index(query.filter.document_id)]
+            else:
+                indices = range(len(self.shards))
+            for index in indices:
+                shard_queries.setdefault(index, []).append(i)
+
+        shard_results = await asyncio.gather(
+            *[
+                self.shards[index]._query([queries[i] for i in query_indices])
+                for index, query_indices in shard_queries.items()
+            ]
+        )
+
+        results: List[List[List[DocumentChunkWithScore]]] = [[] for _ in queries]
+        for query_indices, query_results in zip(shard_queries.values(), shard_results):
+            for i, query_result in zip(query_indices, query_results):
+                results[i].append(query_result.results)
+
+        return [
+            QueryResult(
+                query=query.query,
+                results=heapq.nlargest(
+                    query.top_k,  # type: ignore
+                    itertools.chain.from_iterable(results[i]),
+                    key=lambda result: result.score,
+                ),
+            )
+            for i, query in enumerate(queries)
+        ]
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        The ids only go to the shards owning them, as does a filter on a document id, other filters go to every shard.
+        Returns whether the operation was successful on every shard.
+        """
+        if delete_all:
+            results = await asyncio.gather(
+                *[shard.delete(delete_all=True) for shard in self.shards]
+            )
+            return all(results)
+
+        shard_ids: Dict[int, List[str]] = {}
+        for document_id in ids or []:
+            shard_ids.setdefault(self._get_shard_index(document_id), []).append(
+                document_id
+            )
+        if filter is None:
+            filter_shards = set()
+        elif filter.document_id:
+            filter_shards = {self._get_shard_index(filter.document_id)}
+        else:
+            filter_shards = set(range(len(self.shards)))
+
+        results = await asyncio.gather(
+            *[
+                self.shards[index].delete(
+                    ids=shard_ids.get(index),
+                    filter=filter if index in filter_shards else None,
+                    delete_all=False,
+                )
+                for index in sorted(filter_shards.union(shard_ids))
+            ]
+        )
+        return all(results)
+
+    async def close(self) -> None:
+        await asyncio.gather(*[shard.close() for shard in self.shards])
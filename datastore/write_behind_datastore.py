@@ -0,0 +1,275 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from datastore.datastore import DataStore
+from models.models import (
+    Document,
+    DocumentChunk,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+# Seconds the upserts are buffered for before they are flushed to the datastore
+WRITE_BEHIND_WINDOW = float(os.environ.get("WRITE_BEHIND_WINDOW", 5))
+# Number of buffered documents that triggers a flush before the end of the window, and the size of the flushed batches
+WRITE_BEHIND_MAX_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_MAX_BATCH_SIZE", 100))
+WRITE_BEHIND_LOG_PATH = os.environ.get("WRITE_BEHIND_LOG_PATH", "write_behind.jsonl")
+WRITE_BEHIND_FSYNC = os.environ.get("WRITE_BEHIND_FSYNC", "true").lower() == "true"
+# Failed flushes of a document after which it is moved to the dead-letter log
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+# defaults to the log path with a .dead suffix
+WRITE_BEHIND_DEAD_LETTER_PATH = os.environ.get("WRITE_BEHIND_DEAD_LETTER_PATH")
+
+
+def _append_log(log_path: str, lines: List[str]) -> None:
+    with open(log_path, "a") as f:
+        f.writelines(lines)
+        f.flush()
+        if WRITE_BEHIND_FSYNC:
+            os.fsync(f.fileno())
+
+
+def _write_log(log_path: str, lines: List[str]) -> None:
+    """Write the log, replacing the previous one only once it is complete."""
+    tmp_path = f"{log_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+        f.flush()
+        if WRITE_BEHIND_FSYNC:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, log_path)
+
+
+def _read_log(log_path: str) -> List[dict]:
+    if not os.path.exists(log_path):
+        return []
+    entries = []
+    with open(log_path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line is cut short if the process died while writing it
+                logger.warning(f"Ignoring a truncated entry of {log_path}")
+                break
+    return entries
+
+
+class WriteBehindDataStore(DataStore):
+    """
+    Buffers the upserts in front of a datastore and flushes them in batches.
+    Only the last version of a document upserted within a window is written, so frequent edits
+    of the same document are embedded and written once. The buffered documents are appended to a
+    local log before the upsert returns and are replayed from it on startup.
+    Queries don't see the documents until they are flushed. A document whose flush keeps failing
+    is moved to a dead-letter log, so it doesn't stay in the buffer forever.
+    """
+
+    def __init__(
+        self,
+        datastore: DataStore,
+        log_path: str = WRITE_BEHIND_LOG_PATH,
+        window: float = WRITE_BEHIND_WINDOW,
+        max_batch_size: int = WRITE_BEHIND_MAX_BATCH_SIZE,
+        max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS,
+        dead_letter_path: Optional[str] = WRITE_BEHIND_DEAD_LETTER_PATH,
+    ):
+        self.datastore = datastore
+        self.log_path = log_path
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path or f"{log_path}.dead"
+        # buffered document, its chunk token size and its log line by document id
+        self._pending: Dict[str, Tuple[Document, Optional[int], str]] = {}
+        # failed flushes of the buffered version of a document by document id
+        self._attempts: Dict[str, int] = {}
+        self._log_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._batch_full = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def init(cls, datastore: DataStore, **kwargs):
+        """
+        Creates the buffer and replays the upserts of the log that weren't flushed.
+        """
+        write_behind = cls(datastore, **kwargs)
+        for entry in await asyncio.to_thread(_read_log, write_behind.log_path):
+            document = Document(**entry["document"])
+            write_behind._pending[document.id] = (  # type: ignore
+                document,
+                entry["chunk_token_size"],
+                json.dumps(entry) + "\n",
+            )
+        if write_behind._pending:
+            write_behind._start_flushing()
+        return write_behind
+
+    def _start_flushing(self) -> None:
+        if self._flush_task is None:
+            # started lazily, as it needs a running event loop
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush the buffered upserts: {e}")
+
+    async def upsert(
+        self, documents: List[Document], chunk_token_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Takes in a list of documents and buffers them until the next flush.
+        Return a list of document ids.
+        """
+        # the ids are returned before the documents are chunked, so they are set here
+        documents = [
+            document.copy(update={"id": document.id or str(uuid.uuid4())})
+            for document in documents
+        ]
+        lines = [
+            json.dumps(
+                {"document": document.dict(), "chunk_token_size": chunk_token_size}
+            )
+            + "\n"
+            for document in documents
+        ]
+        async with self._log_lock:
+            await asyncio.to_thread(_append_log, self.log_path, lines)
+            for document, line in zip(documents, lines):
+                # the previous version of the document is dropped
+                self._pending[document.id] = (document, chunk_token_size, line)  # type: ignore
+                self._attempts.pop(document.id, None)  # type: ignore
+
+        self._start_flushing()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return [document.id for document in documents]  # type: ignore
+
+    async def flush(self) -> None:
+        """
+        Upserts the buffered documents into the datastore in batches and removes them from the log.
+        The documents of a failed batch are buffered again, unless a newer version was buffered meanwhile,
+        and are moved to the dead-letter log once they failed max_attempts times.
+        The first error is raised once every batch was tried.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            groups: Dict[Optional[int], List[str]] = {}
+            for document_id, (_, chunk_token_size, _) in batch.items():
+                groups.setdefault(chunk_token_size, []).append(document_id)
+            flushed: Set[str] = set()
+            errors: Dict[str, Exception] = {}
+            try:
+                for chunk_token_size, document_ids in groups.items():
+                    for i in range(0, len(document_ids), self.max_batch_size):
+                        batch_ids = document_ids[i : i + self.max_batch_size]
+                        try:
+                            await self.datastore.upsert(
+                                [batch[document_id][0] for document_id in batch_ids],
+                                chunk_token_size,
+                            )
+                        except Exception as e:
+                            errors.update((document_id, e) for document_id in batch_ids)
+                        else:
+                            flushed.update(batch_ids)
+            except BaseException:
+                # the flush is cancelled on close, the documents not written yet are kept
+                for document_id, entry in batch.items():
+                    if document_id not in flushed:
+                        self._pending.setdefault(document_id, entry)
+                raise
+
+            dead_lines: List[str] = []
+            for document_id, error in errors.items():
+                if document_id in self._pending:
+                    # a newer version was buffered meanwhile, it replaces the failed one
+                    continue
+                attempts = self._attempts.get(document_id, 0) + 1
+                if attempts < self.max_attempts:
+                    self._attempts[document_id] = attempts
+                    self._pending[document_id] = batch[document_id]
+                    continue
+                self._attempts.pop(document_id, None)
+                logger.error(
+                    f"Moving document {document_id} to {self.dead_letter_path} after {attempts} failed flushes: {error}"
+                )
+                entry = json.loads(batch[document_id][2])
+                entry["error"] = str(error)
+                dead_lines.append(json.dumps(entry) + "\n")
+            for document_id in flushed:
+                self._attempts.pop(document_id, None)
+
+            # the log only keeps the documents still buffered
+            async with self._log_lock:
+                if dead_lines:
+                    await asyncio.to_thread(
+                        _append_log, self.dead_letter_path, dead_lines
+                    )
+                await asyncio.to_thread(
+                    _write_log,
+                    self.log_path,
+                    [line for _, _, line in self._pending.values()],
+                )
+            if errors:
+                raise next(iter(errors.values()))
+
+    async def close(self) -> None:
+        """
+        Stops the periodic flushes, flushes the buffered documents and closes the datastore.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self.datastore.close()
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of document chunks and inserts them into the datastore without buffering them.
+        Return a list of document ids.
+        """
+        return await self.datastore._upsert(chunks)
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
+        """
+        return await self.datastore._query(queries)
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        The buffered documents are flushed first so the delete applies to them too, or dropped if everything is deleted.
+        Returns whether the operation was successful.
+        """
+        if delete_all:
+            async with self._flush_lock, self._log_lock:
+                self._pending.clear()
+                await asyncio.to_thread(_write_log, self.log_path, [])
+        else:
+            await self.flush()
+        return await self.datastore.delete(
+            ids=ids, filter=filter, delete_all=delete_all
+        )
@@ -144,5 +144,11 @@ async def startup():
     datastore = await get_datastore()
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    # the buffered upserts and index changes would otherwise be lost or wait for the next startup
+    await datastore.close()
+
+
 def start():
     uvicorn.run("local_server.main:app", host="localhost", port=PORT, reload=True)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, confloat
 from typing import List, Optional
 from enum import Enum
 
@@ -26,6 +26,8 @@ class DocumentChunk(BaseModel):
     text: str
     metadata: DocumentChunkMetadata
     embedding: Optional[List[float]] = None
+    # hash of the text, metadata and embedding model of the chunk, used to skip unchanged chunks on upsert
+    content_hash: Optional[str] = Field(default=None, exclude=True)
 
 
 class DocumentChunkWithScore(DocumentChunk):
@@ -51,10 +53,17 @@ class DocumentMetadataFilter(BaseModel):
     end_date: Optional[str] = None  # any date string format
 
 
+DEFAULT_TOP_K = 3
+
+
 class Query(BaseModel):
     query: str
     filter: Optional[DocumentMetadataFilter] = None
-    top_k: Optional[int] = 3
+    top_k: Optional[int] = DEFAULT_TOP_K
+    # target recall between 0 and 1, used to tune approximate vector indexes
+    recall: Optional[confloat(ge=0, le=1)] = None  # type: ignore
+    # weight of the vector search against the keyword search for hybrid search, between 0 and 1
+    alpha: Optional[confloat(ge=0, le=1)] = None  # type: ignore
 
 
 class QueryWithEmbedding(Query):
@@ -152,5 +152,11 @@ async def startup():
     datastore = await get_datastore()
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    # the buffered upserts and index changes would otherwise be lost or wait for the next startup
+    await datastore.close()
+
+
 def start():
     uvicorn.run("server.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,11 +1,13 @@
 from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
 import uuid
 import os
 from models.models import Document, DocumentChunk, DocumentChunkMetadata
 
 import tiktoken
 
-from services.openai import get_embeddings
+from services.openai import EMBEDDING_DIMENSION, EMBEDDING_MODEL, get_embeddings
 
 # Global variables
 tokenizer = tiktoken.get_encoding(
@@ -99,6 +101,36 @@ def get_text_chunks(text: str, chunk_token_size: Optional[int]) -> List[str]:
     return chunks
 
 
+def get_chunk_content_hashes(
+    text_chunks: List[str], metadata: DocumentChunkMetadata
+) -> List[str]:
+    """
+    Hash the text of each chunk of a document along with their metadata and the embedding model, so the hash of a chunk changes whenever the stored chunk would.
+
+    Args:
+        text_chunks: The texts of the chunks.
+        metadata: The metadata of the chunks, which is serialized once for all of them.
+
+    Returns:
+        The hex digests of the hashes, in the order of the texts.
+    """
+    prefix = json.dumps(
+        {
+            "metadata": metadata.dict(),
+            "embedding_model": EMBEDDING_MODEL,
+            "embedding_dimension": EMBEDDING_DIMENSION,
+        },
+        sort_keys=True,
+    )
+    prefix_hash = hashlib.sha256(prefix.encode("utf-8"))
+    content_hashes = []
+    for text in text_chunks:
+        content_hash = prefix_hash.copy()
+        content_hash.update(text.encode("utf-8"))
+        content_hashes.append(content_hash.hexdigest())
+    return content_hashes
+
+
 def create_document_chunks(
     doc: Document, chunk_token_size: Optional[int]
 ) -> Tuple[List[DocumentChunk], str]:
@@ -112,6 +144,7 @@ def create_document_chunks(
     Returns:
         A tuple of (doc_chunks, doc_id), where doc_chunks is a list of document chunks, each of which is a DocumentChunk object with an id, a document_id, a text, and a metadata attribute,
         and doc_id is the id of the document object, generated if not provided. The id of each chunk is generated from the document id and a sequential number, and the metadata is copied from the document object.
+        Each chunk also gets the content hash of its text and metadata.
     """
     # Check if the document text is empty or whitespace
     if not doc.text or doc.text.isspace():
@@ -134,13 +167,17 @@ def create_document_chunks(
     # Initialize an empty list of chunks for this document
     doc_chunks = []
 
-    # Assign each chunk a sequential number and create a DocumentChunk object
-    for i, text_chunk in enumerate(text_chunks):
+    content_hashes = get_chunk_content_hashes(text_chunks, metadata)
+
+    # Assign each chunk a sequential number and create a DocumentChunk object,
+    # which gets its own copy of the metadata
+    for i, (text_chunk, content_hash) in enumerate(zip(text_chunks, content_hashes)):
         chunk_id = f"{doc_id}_{i}"
         doc_chunk = DocumentChunk(
             id=chunk_id,
             text=text_chunk,
             metadata=metadata,
+            content_hash=content_hash,
         )
         # Append the chunk object to the list of chunks for this document
         doc_chunks.append(doc_chunk)
@@ -149,6 +186,33 @@ def create_document_chunks(
     return doc_chunks, doc_id
 
 
+def embed_document_chunks(chunks: List[DocumentChunk]) -> None:
+    """
+    Set the embeddings of the document chunks, requesting them in batches of EMBEDDINGS_BATCH_SIZE.
+
+    Args:
+        chunks: The list of document chunks to embed.
+    """
+    # Get all the embeddings for the document chunks in batches, using get_embeddings
+    embeddings: List[List[float]] = []
+    for i in range(0, len(chunks), EMBEDDINGS_BATCH_SIZE):
+        # Get the text of the chunks in the current batch
+        batch_texts = [
+            chunk.text for chunk in chunks[i : i + EMBEDDINGS_BATCH_SIZE]
+        ]
+
+        # Get the embeddings for the batch texts
+        batch_embeddings = get_embeddings(batch_texts)
+
+        # Append the batch embeddings to the embeddings list
+        embeddings.extend(batch_embeddings)
+
+    # Update the document chunk objects with the embeddings
+    for i, chunk in enumerate(chunks):
+        # Assign the embedding from the embeddings list to the chunk object
+        chunk.embedding = embeddings[i]
+
+
 def get_document_chunks(
     documents: List[Document], chunk_token_size: Optional[int]
 ) -> Dict[str, List[DocumentChunk]]:
@@ -183,23 +247,6 @@ def get_document_chunks(
     if not all_chunks:
         return {}
 
-    # Get all the embeddings for the document chunks in batches, using get_embeddings
-    embeddings: List[List[float]] = []
-    for i in range(0, len(all_chunks), EMBEDDINGS_BATCH_SIZE):
-        # Get the text of the chunks in the current batch
-        batch_texts = [
-            chunk.text for chunk in all_chunks[i : i + EMBEDDINGS_BATCH_SIZE]
-        ]
-
-        # Get the embeddings for the batch texts
-        batch_embeddings = get_embeddings(batch_texts)
-
-        # Append the batch embeddings to the embeddings list
-        embeddings.extend(batch_embeddings)
-
-    # Update the document chunk objects with the embeddings
-    for i, chunk in enumerate(all_chunks):
-        # Assign the embedding from the embeddings list to the chunk object
-        chunk.embedding = embeddings[i]
+    embed_document_chunks(all_chunks)
 
     return chunks
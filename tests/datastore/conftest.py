@@ -0,0 +1,131 @@
+import asyncio
+from typing import Dict, List, Optional, Set
+
+import pytest
+
+from datastore.datastore import DataStore
+from models.models import (
+    Document,
+    DocumentChunk,
+    DocumentChunkWithScore,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+
+class FakeDataStore(DataStore):
+    """
+    Keeps the chunks in memory, scores them by dot product and records the calls it receives.
+    Upserted documents are recorded without being chunked or embedded. Queries only filter on
+    the document id, unless post_filter is set, in which case they go through _query_with_post_filter.
+    """
+
+    def __init__(
+        self,
+        name: str = "fake",
+        chunks: Optional[List[DocumentChunk]] = None,
+        delay: float = 0,
+        error: bool = False,
+        post_filter: bool = False,
+        failing_ids: Optional[Set[str]] = None,
+    ):
+        self.name = name
+        self.chunks: Dict[str, DocumentChunk] = {
+            chunk.id: chunk for chunk in chunks or []  # type: ignore
+        }
+        self.delay = delay
+        self.error = error
+        self.post_filter = post_filter
+        self.failing_ids = failing_ids or set()
+        self.calls: List[str] = []
+        self.upserts: List[List[Document]] = []
+        self.queries: List[str] = []
+        self.requested_top_ks: List[List[int]] = []
+        self.deletes: List[dict] = []
+        self.deleted_chunks: Dict[str, List[str]] = {}
+
+    def _check(self) -> None:
+        if self.error:
+            raise RuntimeError(f"{self.name} is down")
+
+    async def upsert(
+        self, documents: List[Document], chunk_token_size: Optional[int] = None
+    ) -> List[str]:
+        self._check()
+        if any(document.id in self.failing_ids for document in documents):
+            raise RuntimeError(f"{self.name} rejected the documents")
+        self.upserts.append(documents)
+        return [document.id for document in documents]  # type: ignore
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        self.calls.append("upsert")
+        self._check()
+        for document_chunks in chunks.values():
+            for chunk in document_chunks:
+                self.chunks[chunk.id] = chunk  # type: ignore
+        return list(chunks.keys())
+
+    async def _delete_chunks(self, chunk_ids: Dict[str, List[str]]) -> None:
+        self.calls.append("delete_chunks")
+        self._check()
+        self.deleted_chunks.update(chunk_ids)
+        for ids in chunk_ids.values():
+            for id_ in ids:
+                self.chunks.pop(id_, None)
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        self.calls.append("query")
+        await asyncio.sleep(self.delay)
+        self._check()
+        if self.post_filter:
+            return await self._query_with_post_filter(queries, self._search)
+        return await self._search(queries)
+
+    async def _search(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        self.requested_top_ks.append([query.top_k for query in queries])  # type: ignore
+        results = []
+        for query in queries:
+            self.queries.append(query.query)
+            document_id = None
+            if query.filter and not self.post_filter:
+                document_id = query.filter.document_id
+            scored = [
+                DocumentChunkWithScore(
+                    **chunk.dict(),
+                    score=sum(a * b for a, b in zip(query.embedding, chunk.embedding)),  # type: ignore
+                )
+                for chunk in self.chunks.values()
+                if document_id is None or chunk.metadata.document_id == document_id
+            ]
+            scored.sort(key=lambda result: result.score, reverse=True)
+            results.append(
+                QueryResult(query=query.query, results=scored[: query.top_k])
+            )
+        return results
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        self.calls.append("delete")
+        self._check()
+        self.deletes.append({"ids": ids, "filter": filter, "delete_all": delete_all})
+        if delete_all:
+            self.chunks.clear()
+        document_ids = set(ids or [])
+        if filter and filter.document_id:
+            document_ids.add(filter.document_id)
+        self.chunks = {
+            id_: chunk
+            for id_, chunk in self.chunks.items()
+            if chunk.metadata.document_id not in document_ids
+        }
+        return True
+
+
+@pytest.fixture
+def fake_datastore():
+    return FakeDataStore
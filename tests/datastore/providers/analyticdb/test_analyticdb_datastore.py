@@ -211,6 +211,30 @@ async def test_query_accuracy(analyticdb_datastore, document_chunk_one):
     assert "abc_123" == query_results[0].results[0].id
 
 
+@pytest.mark.asyncio
+async def test_query_multiple(analyticdb_datastore, document_chunk_one):
+    await analyticdb_datastore.delete(delete_all=True)
+    await analyticdb_datastore._upsert(document_chunk_one)
+    queries = [
+        QueryWithEmbedding(
+            query="lorem",
+            top_k=1,
+            embedding=[0] * OUTPUT_DIM,
+        ),
+        QueryWithEmbedding(
+            query="ipsum",
+            top_k=2,
+            embedding=[2] * OUTPUT_DIM,
+            filter=DocumentMetadataFilter(source=Source.chat),
+        ),
+    ]
+    query_results = await analyticdb_datastore._query(queries=queries)
+
+    assert ["lorem", "ipsum"] == [result.query for result in query_results]
+    assert ["abc_123"] == [chunk.id for chunk in query_results[0].results]
+    assert ["ghi_789"] == [chunk.id for chunk in query_results[1].results]
+
+
 @pytest.mark.asyncio
 async def test_query_filter(analyticdb_datastore, document_chunk_one):
     await analyticdb_datastore.delete(delete_all=True)
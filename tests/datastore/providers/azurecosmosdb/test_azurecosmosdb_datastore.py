@@ -7,6 +7,7 @@ from datastore.providers.azurecosmosdb_datastore import AzureCosmosDBDataStore
 from models.models import (
     DocumentChunk,
     DocumentChunkMetadata,
+    DocumentMetadataFilter,
     QueryWithEmbedding,
 )
 import os
@@ -100,6 +101,26 @@ async def test_upsert(
     ]
 
 
+@pytest.mark.asyncio
+async def test_upsert_in_batches(
+    azurecosmosdb_datastore: AzureCosmosDBDataStore,
+    initial_document_chunks: Dict[str, List[DocumentChunk]],
+    queries: List[QueryWithEmbedding],
+    monkeypatch,
+) -> None:
+    """Test upsert with every chunk written in its own batch."""
+    monkeypatch.setattr(
+        "datastore.providers.azurecosmosdb_datastore.AZCOSMOS_UPSERT_BATCH_SIZE", 1
+    )
+    await azurecosmosdb_datastore.delete(delete_all=True)
+    await azurecosmosdb_datastore._upsert(initial_document_chunks)
+    # upserting again replaces the chunks rather than failing on duplicate ids
+    await azurecosmosdb_datastore._upsert(initial_document_chunks)
+
+    query_results = await azurecosmosdb_datastore._query(queries)
+    assert len(query_results[1].results) == 2
+
+
 @pytest.mark.asyncio
 async def test_query(
     azurecosmosdb_datastore: AzureCosmosDBDataStore,
@@ -126,6 +147,40 @@ async def test_query(
     assert query_1_results[1].id == "doc:first-doc:chunk:first-doc-4"
 
 
+@pytest.mark.asyncio
+async def test_query_with_filter_and_recall(
+    azurecosmosdb_datastore: AzureCosmosDBDataStore,
+    initial_document_chunks: Dict[str, List[DocumentChunk]],
+) -> None:
+    """Test that the filter is applied in the vector search."""
+    await azurecosmosdb_datastore.delete(delete_all=True)
+    await azurecosmosdb_datastore._upsert(initial_document_chunks)
+    await azurecosmosdb_datastore._upsert(
+        {
+            "second-doc": [
+                DocumentChunk(
+                    id="second-doc-4",
+                    text="Dolor sit amet",
+                    metadata=DocumentChunkMetadata(),
+                    embedding=create_embedding(4),
+                )
+            ]
+        }
+    )
+
+    query = QueryWithEmbedding(
+        query="Query 1",
+        top_k=2,
+        embedding=create_embedding(4),
+        filter=DocumentMetadataFilter(document_id="second-doc"),
+        recall=0.99,
+    )
+    query_results = await azurecosmosdb_datastore._query([query])
+
+    assert len(query_results[0].results) == 1
+    assert query_results[0].results[0].id == "doc:second-doc:chunk:second-doc-4"
+
+
 @pytest.mark.asyncio
 async def test_delete(azurecosmosdb_datastore: AzureCosmosDBDataStore) -> None:
     await azurecosmosdb_datastore.delete(delete_all=True)
@@ -107,6 +107,22 @@ async def test_lifecycle_semantic(azuresearch_mgmt_client: SearchIndexClient):
     await lifecycle(azuresearch_mgmt_client)
 
 
+@pytest.mark.asyncio
+async def test_lifecycle_small_batches(
+    azuresearch_mgmt_client: SearchIndexClient, monkeypatch
+):
+    datastore.providers.azuresearch_datastore.AZURESEARCH_DISABLE_HYBRID = None
+    datastore.providers.azuresearch_datastore.AZURESEARCH_SEMANTIC_CONFIG = None
+    # every chunk is uploaded and deleted in its own concurrent batch
+    monkeypatch.setattr(
+        datastore.providers.azuresearch_datastore, "MAX_UPLOAD_BATCH_SIZE", 1
+    )
+    monkeypatch.setattr(
+        datastore.providers.azuresearch_datastore, "MAX_DELETE_BATCH_SIZE", 1
+    )
+    await lifecycle(azuresearch_mgmt_client)
+
+
 async def lifecycle(azuresearch_mgmt_client: SearchIndexClient):
     if AZURESEARCH_TEST_INDEX in azuresearch_mgmt_client.list_index_names():
         azuresearch_mgmt_client.delete_index(AZURESEARCH_TEST_INDEX)
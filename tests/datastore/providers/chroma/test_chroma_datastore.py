@@ -3,8 +3,10 @@ from typing import Dict, List
 import pytest
 import random
 
+from datastore.providers import chroma_datastore
 from datastore.providers.chroma_datastore import ChromaDataStore
 from models.models import (
+    Document,
     DocumentChunk,
     DocumentChunkMetadata,
     DocumentMetadataFilter,
@@ -134,6 +136,37 @@ async def test_upsert(
         )
 
 
+@pytest.mark.asyncio
+async def test_upsert_in_batches(document_chunks, monkeypatch):
+    monkeypatch.setattr(chroma_datastore, "CHROMA_UPSERT_BATCH_SIZE", 3)
+    for datastore in get_chroma_datastore():
+        await datastore.delete(delete_all=True)
+
+        assert await datastore._upsert(document_chunks) == list(document_chunks.keys())
+        assert datastore._collection.count() == sum(
+            len(v) for v in document_chunks.values()
+        )
+
+
+@pytest.mark.asyncio
+async def test_upsert_converts_metadata_once_per_document(document_chunks):
+    for datastore in get_chroma_datastore():
+        await datastore.delete(delete_all=True)
+        converted = []
+        process_metadata = datastore._process_metadata_for_storage
+
+        def process_metadata_for_storage(metadata):
+            converted.append(metadata.document_id)
+            return process_metadata(metadata)
+
+        datastore._process_metadata_for_storage = process_metadata_for_storage  # type: ignore
+        await datastore._upsert(document_chunks)
+
+        assert converted == ["first-doc", "second-doc"]
+        stored = datastore._collection.get(ids=["second-doc-3"], include=["metadatas"])
+        assert stored["metadatas"][0]["document_id"] == "second-doc"
+
+
 @pytest.mark.asyncio
 async def test_add_and_query_all(document_chunks):
     for datastore in get_chroma_datastore():
@@ -184,6 +217,36 @@ async def test_query_accuracy(document_chunks):
                 assert query_results[0].results[0].id == chunk.id
 
 
+@pytest.mark.asyncio
+async def test_query_batch(document_chunks):
+    for datastore in get_chroma_datastore():
+        await datastore.delete(delete_all=True)
+
+        await datastore._upsert(document_chunks)
+
+        chunks = document_chunks["first-doc"] + document_chunks["second-doc"]
+        queries = [
+            QueryWithEmbedding(query="a", embedding=chunks[0].embedding, top_k=1),
+            QueryWithEmbedding(query="b", embedding=chunks[-1].embedding, top_k=3),
+            QueryWithEmbedding(
+                query="c",
+                embedding=chunks[-1].embedding,
+                top_k=N_TEST_CHUNKS,
+                filter=DocumentMetadataFilter(document_id="first-doc"),
+            ),
+        ]
+        query_results = await datastore._query(queries=queries)
+
+        # Assert that the results come back per query in order, with their own top_k
+        assert ["a", "b", "c"] == [result.query for result in query_results]
+        assert [chunks[0].id] == [result.id for result in query_results[0].results]
+        assert 3 == len(query_results[1].results)
+        assert chunks[-1].id == query_results[1].results[0].id
+        assert sorted(chunk.id for chunk in document_chunks["first-doc"]) == sorted(
+            result.id for result in query_results[2].results
+        )
+
+
 @pytest.mark.asyncio
 async def test_query_filter_by_id(document_chunks):
     for datastore in get_chroma_datastore():
@@ -291,3 +354,39 @@ async def test_delete_by_id(document_chunks):
                 for result in query_results[0].results
             ]
         )
+
+
+@pytest.mark.asyncio
+async def test_upsert_only_changed_chunks(monkeypatch):
+    embedded_texts: List[str] = []
+
+    def get_embeddings(texts: List[str]) -> List[List[float]]:
+        embedded_texts.extend(texts)
+        return [create_embedding(TEST_EMBEDDING_DIM) for _ in texts]
+
+    monkeypatch.setattr("services.chunks.get_embeddings", get_embeddings)
+    sentences = [f"This is sentence number {i} of the document." for i in range(20)]
+    for datastore in get_chroma_datastore():
+        await datastore.delete(delete_all=True)
+        document = Document(id="doc", text=" ".join(sentences))
+
+        await datastore.upsert([document], chunk_token_size=20)
+        count = datastore._collection.count()
+        assert len(embedded_texts) == count > 1
+
+        # unchanged chunks aren't embedded nor written again
+        embedded_texts.clear()
+        await datastore.upsert([document], chunk_token_size=20)
+        assert embedded_texts == []
+
+        document.text = " ".join(sentences[:-1] + ["The last sentence changed."])
+        await datastore.upsert([document], chunk_token_size=20)
+        assert 0 < len(embedded_texts) < count
+        assert "changed" in embedded_texts[-1]
+
+        # the chunks the document no longer has are deleted
+        embedded_texts.clear()
+        document.text = ""
+        await datastore.upsert([document], chunk_token_size=20)
+        assert embedded_texts == []
+        assert datastore._collection.count() == 0
@@ -80,11 +80,34 @@ async def test_upsert(elasticsearch_datastore, document_chunk_one):
     assert res == list(document_chunk_one.keys())
     time.sleep(1)
 
-    results = elasticsearch_datastore.client.search(
+    results = await elasticsearch_datastore.client.search(
         index=elasticsearch_datastore.index_name, query={"match_all": {}}
     )
     assert results["hits"]["total"]["value"] == 3
-    elasticsearch_datastore.client.indices.delete(
+    await elasticsearch_datastore.client.indices.delete(
+        index=elasticsearch_datastore.index_name
+    )
+
+
+async def test_upsert_in_chunks(
+    elasticsearch_datastore, document_chunk_one, monkeypatch
+):
+    monkeypatch.setattr(
+        "datastore.providers.elasticsearch_datastore.ELASTICSEARCH_BULK_CHUNK_SIZE", 1
+    )
+    monkeypatch.setattr(
+        "datastore.providers.elasticsearch_datastore.ELASTICSEARCH_BULK_CONCURRENCY", 2
+    )
+    await elasticsearch_datastore.delete(delete_all=True)
+    res = await elasticsearch_datastore._upsert(document_chunk_one)
+    assert res == list(document_chunk_one.keys())
+    time.sleep(1)
+
+    results = await elasticsearch_datastore.client.search(
+        index=elasticsearch_datastore.index_name, query={"match_all": {}}
+    )
+    assert results["hits"]["total"]["value"] == 3
+    await elasticsearch_datastore.client.indices.delete(
         index=elasticsearch_datastore.index_name
     )
 
@@ -106,6 +129,29 @@ async def test_upsert_query_all(elasticsearch_datastore, document_chunk_one):
     assert 3 == len(query_results[0].results)
 
 
+async def test_query_recall(elasticsearch_datastore, document_chunk_one):
+    await elasticsearch_datastore.delete(delete_all=True)
+    await elasticsearch_datastore._upsert(document_chunk_one)
+    time.sleep(1)
+
+    queries = [
+        QueryWithEmbedding(
+            query="Aenean",
+            top_k=2,
+            embedding=sample_embedding(0),  # type: ignore
+            recall=recall,
+        )
+        for recall in [0.5, 0.99, 1.0]
+    ]
+    query_results = await elasticsearch_datastore._query(queries=queries)
+
+    assert 3 == len(query_results)
+    for query_result in query_results:
+        assert 2 == len(query_result.results)
+        assert "123" == query_result.results[0].id
+        assert query_result.results[0].embedding is None
+
+
 async def test_delete_with_document_id(elasticsearch_datastore, document_chunk_one):
     await elasticsearch_datastore.delete(delete_all=True)
     res = await elasticsearch_datastore._upsert(document_chunk_one)
@@ -124,7 +170,7 @@ async def test_delete_with_document_id(elasticsearch_datastore, document_chunk_o
     assert 1 == len(query_results)
     assert 0 == len(query_results[0].results)
 
-    elasticsearch_datastore.client.indices.delete(
+    await elasticsearch_datastore.client.indices.delete(
         index=elasticsearch_datastore.index_name
     )
 
@@ -154,6 +200,6 @@ async def test_delete_with_source_filter(elasticsearch_datastore, document_chunk
     assert 2 == len(query_results[0].results)
     assert "456" == query_results[0].results[0].id
 
-    elasticsearch_datastore.client.indices.delete(
+    await elasticsearch_datastore.client.indices.delete(
         index=elasticsearch_datastore.index_name
     )
@@ -1,7 +1,13 @@
+import os
 from typing import Dict, List
 import pytest
-from datastore.providers.llama_datastore import LlamaDataStore
-from models.models import DocumentChunk, DocumentChunkMetadata, QueryWithEmbedding
+from datastore.providers.llama_datastore import LlamaDataStore, _create_or_load_index
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentMetadataFilter,
+    QueryWithEmbedding,
+)
 
 
 def create_embedding(non_zero_pos: int, size: int) -> List[float]:
@@ -83,6 +89,41 @@ async def test_query(
     assert query_1_results[1].id == "first-doc-4"
 
 
+@pytest.mark.asyncio
+async def test_query_with_filter(
+    llama_datastore: LlamaDataStore,
+    initial_document_chunks: Dict[str, List[DocumentChunk]],
+) -> None:
+    """Test that the filters are applied to the results."""
+    await llama_datastore._upsert(initial_document_chunks)
+    await llama_datastore._upsert(
+        {
+            "second-doc": [
+                DocumentChunk(
+                    id=f"second-doc-{i}",
+                    text=f"Dolor sit amet {i}",
+                    metadata=DocumentChunkMetadata(document_id="second-doc"),
+                    embedding=create_embedding(i, 5),
+                )
+                for i in range(2)
+            ]
+        }
+    )
+
+    query = QueryWithEmbedding(
+        query="Query 1",
+        top_k=2,
+        embedding=create_embedding(4, 5),
+        filter=DocumentMetadataFilter(document_id="second-doc"),
+    )
+    query_results = await llama_datastore._query([query])
+
+    assert sorted(result.id for result in query_results[0].results) == [
+        "second-doc-0",
+        "second-doc-1",
+    ]
+
+
 @pytest.mark.asyncio
 async def test_delete(
     llama_datastore: LlamaDataStore,
@@ -93,3 +134,39 @@ async def test_delete(
 
     is_success = llama_datastore.delete(["first-doc"])
     assert is_success
+
+
+@pytest.mark.asyncio
+async def test_persist(
+    tmp_path,
+    initial_document_chunks: Dict[str, List[DocumentChunk]],
+    queries: List[QueryWithEmbedding],
+) -> None:
+    index_json_path = str(tmp_path / "index.json")
+    llama_datastore = LlamaDataStore(index_json_path=index_json_path)
+    await llama_datastore._upsert(initial_document_chunks)
+    await llama_datastore.persist()
+
+    # a new datastore reloads the snapshot
+    reloaded_datastore = LlamaDataStore(
+        index=_create_or_load_index(index_json_path=index_json_path)
+    )
+    query_results = await reloaded_datastore._query(queries)
+    assert query_results[0].results[0].id == "first-doc-4"
+
+
+@pytest.mark.asyncio
+async def test_close_persists(
+    tmp_path,
+    initial_document_chunks: Dict[str, List[DocumentChunk]],
+) -> None:
+    index_json_path = str(tmp_path / "index.json")
+    llama_datastore = LlamaDataStore(index_json_path=index_json_path)
+    await llama_datastore._upsert(initial_document_chunks)
+    persist_task = llama_datastore._persist_task
+    assert persist_task is not None
+
+    await llama_datastore.close()
+
+    assert persist_task.cancelled()
+    assert os.path.exists(index_json_path)
@@ -234,6 +234,40 @@ async def test_query_accuracy(milvus_datastore, document_chunk_one):
     milvus_datastore.col.drop()
 
 
+@pytest.mark.asyncio
+async def test_query_batch(milvus_datastore, document_chunk_one):
+    await milvus_datastore.delete(delete_all=True)
+    res = await milvus_datastore._upsert(document_chunk_one)
+    assert res == list(document_chunk_one.keys())
+    milvus_datastore.col.flush()
+    queries = [
+        QueryWithEmbedding(
+            query="lorem",
+            top_k=1,
+            embedding=sample_embedding(0),
+        ),
+        QueryWithEmbedding(
+            query="ipsum",
+            top_k=2,
+            embedding=sample_embedding(2),
+        ),
+        QueryWithEmbedding(
+            query="dolor",
+            top_k=3,
+            embedding=sample_embedding(0),
+            filter=DocumentMetadataFilter(source=Source.chat),
+        ),
+    ]
+    query_results = await milvus_datastore._query(queries=queries)
+
+    assert ["lorem", "ipsum", "dolor"] == [result.query for result in query_results]
+    assert ["abc_123"] == [result.id for result in query_results[0].results]
+    assert 2 == len(query_results[1].results)
+    assert "ghi_789" == query_results[1].results[0].id
+    assert ["ghi_789"] == [result.id for result in query_results[2].results]
+    milvus_datastore.col.drop()
+
+
 @pytest.mark.asyncio
 async def test_query_filter(milvus_datastore, document_chunk_one):
     await milvus_datastore.delete(delete_all=True)
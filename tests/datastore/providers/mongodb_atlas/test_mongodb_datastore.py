@@ -151,6 +151,21 @@ async def test_upsert(mongodb_datastore: MongoDBAtlasDataStore, one_documents_ch
     await assert_when_ready(collection_size_callback_factory(collection, 3))
 
 
+async def test_upsert_in_batches(mongodb_datastore, one_documents_chunks, chunk_ids, monkeypatch):
+    """Every chunk is written in its own bulk_write batch."""
+    monkeypatch.setattr(
+        "datastore.providers.mongodb_atlas_datastore.MONGODB_UPSERT_BATCH_BYTES", 1
+    )
+    res = await mongodb_datastore._upsert(one_documents_chunks)
+    assert res == chunk_ids
+
+    collection = mongodb_datastore.client[mongodb_datastore.database_name][mongodb_datastore.collection_name]
+    await assert_when_ready(collection_size_callback_factory(collection, 3))
+    document = await collection.find_one({"_id": chunk_ids[0]})
+    assert "id" not in document
+    assert document["created_at"] == to_unix_timestamp("1929-10-28T09:30:00-05:00")
+
+
 async def test_upsert_query_all(mongodb_datastore, one_documents_chunks, chunk_ids):
     """By running _query, this performs """
     res = await mongodb_datastore._upsert(one_documents_chunks)
@@ -169,6 +184,36 @@ async def test_upsert_query_all(mongodb_datastore, one_documents_chunks, chunk_i
     await assert_when_ready(predicate, tries=12, interval=5)
 
 
+async def test_query_with_filters(mongodb_datastore, one_documents_chunks, chunk_ids):
+    res = await mongodb_datastore._upsert(one_documents_chunks)
+    assert res == chunk_ids
+
+    queries = [
+        QueryWithEmbedding(
+            query="Aenean",
+            top_k=10,
+            embedding=sample_embedding(0),  # type: ignore
+            filter=DocumentMetadataFilter(source=Source.file),
+        ),
+        QueryWithEmbedding(
+            query="Aenean",
+            top_k=10,
+            embedding=sample_embedding(0),  # type: ignore
+            filter=DocumentMetadataFilter(start_date="2000-01-01T00:00:00Z"),
+        ),
+    ]
+
+    async def predicate():
+        query_results = await mongodb_datastore._query(queries=queries)
+        return [len(query_result.results) for query_result in query_results] == [1, 2]
+
+    await assert_when_ready(predicate, tries=12, interval=5)
+    query_results = await mongodb_datastore._query(queries=queries)
+    assert query_results[0].results[0].text == "Vivamus non enim vitae tortor"
+    for result in query_results[1].results:
+        assert result.metadata.author != "Fred Smith"
+
+
 async def test_delete_with_document_id(mongodb_datastore, one_documents_chunks, chunk_ids):
     res = await mongodb_datastore._upsert(one_documents_chunks)
     assert res == chunk_ids
@@ -1,5 +1,7 @@
 from typing import Dict, List
 import pytest
+from datastore.providers import pgvector_datastore
+from datastore.providers.pgvector_datastore import PGClient, PgVectorDataStore
 from datastore.providers.postgres_datastore import PostgresDataStore
 from models.models import (
     DocumentChunk,
@@ -150,6 +152,42 @@ async def test_upsert_existing_chunk(postgres_datastore):
     assert results[0].results[0].text == "New text"
 
 
+@pytest.mark.asyncio
+async def test_upsert_batch(postgres_datastore):
+    await postgres_datastore.delete(delete_all=True)
+    chunks = [
+        DocumentChunk(
+            id=f"chunk{i}",
+            text=f"Sample text {i}",
+            embedding=create_embedding(i + 1),
+            metadata=DocumentChunkMetadata(),
+        )
+        for i in range(10)
+    ]
+    # the same chunk id twice in one batch keeps the last version
+    chunks.append(
+        DocumentChunk(
+            id="chunk0",
+            text="New text",
+            embedding=create_embedding(1),
+            metadata=DocumentChunkMetadata(),
+        )
+    )
+    ids = await postgres_datastore._upsert({"doc1": chunks})
+
+    query = QueryWithEmbedding(
+        query="Query",
+        embedding=create_embedding(1),
+        top_k=20,
+    )
+    results = await postgres_datastore._query([query])
+
+    assert ids == ["doc1"]
+    assert len(results[0].results) == 10
+    assert results[0].results[0].id == "chunk0"
+    assert results[0].results[0].text == "New text"
+
+
 @pytest.mark.asyncio
 async def test_query_score(postgres_datastore):
     await postgres_datastore.delete(delete_all=True)
@@ -230,6 +268,216 @@ async def test_query_filter(postgres_datastore):
     assert results[0].results[0].id == "chunk2"
 
 
+@pytest.mark.asyncio
+async def test_query_batch_filters(postgres_datastore):
+    await postgres_datastore.delete(delete_all=True)
+    chunk1 = DocumentChunk(
+        id="chunk1",
+        text="Sample text",
+        embedding=[1] * EMBEDDING_DIMENSION,
+        metadata=DocumentChunkMetadata(author="John"),
+    )
+    chunk2 = DocumentChunk(
+        id="chunk2",
+        text="Another text",
+        embedding=[1] * EMBEDDING_DIMENSION,
+        metadata=DocumentChunkMetadata(author="Mike"),
+    )
+    await postgres_datastore._upsert({"doc1": [chunk1], "doc2": [chunk2]})
+
+    # queries with different filters and top_k are sent in a single statement
+    query_embedding = [1] * EMBEDDING_DIMENSION
+    queries = [
+        QueryWithEmbedding(
+            query="Query 1",
+            embedding=query_embedding,
+            filter=DocumentMetadataFilter(author="Mike"),
+        ),
+        QueryWithEmbedding(
+            query="Query 2",
+            embedding=query_embedding,
+            filter=DocumentMetadataFilter(author="John"),
+        ),
+        QueryWithEmbedding(query="Query 3", embedding=query_embedding, top_k=2),
+    ]
+    results = await postgres_datastore._query(queries)
+
+    assert [result.query for result in results] == ["Query 1", "Query 2", "Query 3"]
+    assert [chunk.id for chunk in results[0].results] == ["chunk2"]
+    assert [chunk.id for chunk in results[1].results] == ["chunk1"]
+    assert len(results[2].results) == 2
+
+
+@pytest.mark.asyncio
+async def test_query_recall(postgres_datastore, monkeypatch):
+    monkeypatch.setattr(pgvector_datastore, "PG_INDEX_TYPE", "hnsw")
+    await postgres_datastore.delete(delete_all=True)
+    chunk = DocumentChunk(
+        id="chunk1",
+        text="Sample text",
+        embedding=[1] * EMBEDDING_DIMENSION,
+        metadata=DocumentChunkMetadata(),
+    )
+    await postgres_datastore._upsert({"doc1": [chunk]})
+    assert await postgres_datastore.rebuild_index(force=True)
+
+    query = QueryWithEmbedding(
+        query="Query",
+        embedding=[1] * EMBEDDING_DIMENSION,
+        recall=0.99,
+    )
+    # a tenth of the misses of the default recall of 0.9 searches ten times wider
+    assert postgres_datastore._get_search_settings([query]) == {"hnsw.ef_search": 400}
+    results = await postgres_datastore._query([query])
+
+    assert results[0].results[0].id == "chunk1"
+
+
+@pytest.mark.asyncio
+async def test_ensure_index_keeps_existing_ivfflat_index(
+    postgres_datastore, monkeypatch
+):
+    monkeypatch.setattr(pgvector_datastore, "PG_INDEX_TYPE", "ivfflat")
+    monkeypatch.setattr(pgvector_datastore, "PG_IVFFLAT_LISTS", None)
+    await postgres_datastore.delete(delete_all=True)
+    await postgres_datastore._upsert(
+        {
+            "doc1": [
+                DocumentChunk(
+                    id="chunk1",
+                    text="Sample text",
+                    embedding=[1] * EMBEDDING_DIMENSION,
+                    metadata=DocumentChunkMetadata(),
+                )
+            ]
+        }
+    )
+    assert await postgres_datastore.rebuild_index(force=True)
+    assert postgres_datastore._index_params == {"lists": 1}
+
+    # a restart keeps the index and the size it was built for, whatever the row count
+    restarted = PostgresDataStore()
+
+    async def create_vector_index(*args, **kwargs):
+        raise AssertionError("the index should be kept")
+
+    monkeypatch.setattr(restarted.client, "create_vector_index", create_vector_index)
+    await restarted.ensure_index()
+
+    assert restarted._index_params == {"lists": 1}
+    assert restarted._indexed_row_count == 1000
+    query = QueryWithEmbedding(
+        query="Query", embedding=[1] * EMBEDDING_DIMENSION, recall=0.99
+    )
+    assert restarted._get_search_settings([query]) == {"ivfflat.probes": 1}
+
+
+class InMemoryClient(PGClient):
+    """Keeps the rows in memory and records the vector indexes it is asked to build."""
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+        self.built_indexes: List[dict] = []
+
+    async def upsert(self, table: str, json: dict) -> None:
+        self.rows[json["id"]] = json
+
+    async def rpc(self, function_name: str, params: dict):
+        raise NotImplementedError
+
+    async def count(self, table: str) -> int:
+        return len(self.rows)
+
+    async def get_vector_index(self, table: str, column: str):
+        return None
+
+    async def create_vector_index(
+        self, table, column, index_type, index_params, replace=False
+    ) -> None:
+        self.built_indexes.append(index_params)
+
+    async def delete_like(self, table: str, column: str, pattern: str) -> None:
+        raise NotImplementedError
+
+    async def delete_in(self, table: str, column: str, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    async def delete_by_filters(self, table: str, filter) -> None:
+        raise NotImplementedError
+
+
+class InMemoryPgVectorDataStore(PgVectorDataStore):
+    def create_db_client(self) -> PGClient:
+        return InMemoryClient()
+
+
+@pytest.mark.asyncio
+async def test_growing_table_rebuilds_index(monkeypatch):
+    monkeypatch.setattr(pgvector_datastore, "PG_INDEX_TYPE", "ivfflat")
+    monkeypatch.setattr(pgvector_datastore, "PG_IVFFLAT_LISTS", None)
+    monkeypatch.setattr(pgvector_datastore, "PG_INDEX_REBUILD_CHECK_INTERVAL", 0)
+    datastore = await InMemoryPgVectorDataStore.init()
+    client = datastore.client
+
+    def chunks(start: int, stop: int) -> Dict[str, List[DocumentChunk]]:
+        return {
+            "doc": [
+                DocumentChunk(
+                    id=f"chunk{i}",
+                    text="Sample text",
+                    embedding=[1.0],
+                    metadata=DocumentChunkMetadata(),
+                )
+                for i in range(start, stop)
+            ]
+        }
+
+    # the index built on the empty table has one list, sized for 1000 rows
+    assert client.built_indexes == [{"lists": 1}]
+    await datastore._upsert(chunks(0, 1999))
+    await datastore._rebuild_task
+    assert client.built_indexes == [{"lists": 1}]
+
+    # the table grows past twice the size the index was built for
+    await datastore._upsert(chunks(1999, 2000))
+    await datastore._rebuild_task
+
+    assert client.built_indexes == [{"lists": 1}, {"lists": 2}]
+    assert datastore._indexed_row_count == 2000
+
+    # the following checks are rate limited
+    monkeypatch.setattr(pgvector_datastore, "PG_INDEX_REBUILD_CHECK_INTERVAL", 60)
+    await datastore._upsert(chunks(2000, 5000))
+    await datastore._rebuild_task
+    assert len(client.built_indexes) == 2
+
+
+@pytest.mark.asyncio
+async def test_ensure_index_replaces_unnamed_index(postgres_datastore, monkeypatch):
+    monkeypatch.setattr(pgvector_datastore, "PG_INDEX_TYPE", "hnsw")
+    # an index created by hand as in the setup docs, which Postgres names documents_embedding_idx
+    pool = await postgres_datastore.client._get_pool()
+    async with pool.connection() as conn:
+        await conn.execute("DROP INDEX IF EXISTS ix_documents_embedding")
+        await conn.execute(
+            "CREATE INDEX ON documents USING ivfflat (embedding vector_ip_ops) WITH (lists = 100)"
+        )
+    assert await postgres_datastore.client.get_vector_index(
+        "documents", "embedding"
+    ) == ("ivfflat", {"lists": 100})
+
+    await postgres_datastore.ensure_index()
+
+    async with pool.connection() as conn:
+        cur = await conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'documents' AND indexdef LIKE '%vector_ip_ops%'"
+        )
+        assert [row[0] for row in await cur.fetchall()] == ["ix_documents_embedding"]
+    assert await postgres_datastore.client.get_vector_index(
+        "documents", "embedding"
+    ) == ("hnsw", {"m": 16, "ef_construction": 64})
+
+
 @pytest.mark.asyncio
 async def test_delete(postgres_datastore):
     await postgres_datastore.delete(delete_all=True)
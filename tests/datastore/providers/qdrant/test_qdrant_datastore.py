@@ -106,6 +106,48 @@ async def test_upsert_creates_all_points(
     assert 5 == client.count(collection_name="documents").count
 
 
+@pytest.mark.asyncio
+async def test_upsert_in_batches(
+    qdrant_datastore,
+    client,
+    document_chunks,
+    monkeypatch,
+):
+    monkeypatch.setattr(
+        "datastore.providers.qdrant_datastore.QDRANT_UPSERT_BATCH_SIZE", 2
+    )
+
+    document_ids = await qdrant_datastore._upsert(document_chunks)
+
+    assert 2 == len(document_ids)
+    assert 5 == client.count(collection_name="documents").count
+
+
+@pytest.mark.asyncio
+async def test_get_chunk_hashes_and_delete_chunks(
+    qdrant_datastore,
+    client,
+    document_chunks,
+):
+    document_chunks["first-doc"][0].content_hash = "hash-0"
+    await qdrant_datastore._upsert(document_chunks)
+
+    hashes = await qdrant_datastore._get_chunk_hashes(["first-doc", "missing-doc"])
+
+    assert {
+        "first-doc": {
+            "first-doc_0": "hash-0",
+            "first-doc_1": None,
+            "first-doc_2": None,
+        },
+        "missing-doc": {},
+    } == hashes
+
+    await qdrant_datastore._delete_chunks({"first-doc": ["first-doc_1", "first-doc_2"]})
+
+    assert 3 == client.count(collection_name="documents").count
+
+
 @pytest.mark.asyncio
 async def test_upsert_does_not_remove_existing_documents_but_store_new(
     qdrant_datastore,
@@ -283,6 +283,19 @@ def test_query(test_db, query, expected_num_results):
     assert len(num_docs) == expected_num_results
 
 
+@pytest.mark.parametrize("alpha", [0, 0.5, 1])
+def test_query_alpha(test_db, alpha):
+    queries = {"queries": [{"query": "lorem ipsum", "top_k": 3, "alpha": alpha}]}
+
+    response = client.post("/query", json=queries)
+    assert response.status_code == 200
+
+    results = response.json()["results"][0]["results"]
+    assert results
+    # vectors are only fetched when WEAVIATE_INCLUDE_VECTORS is set
+    assert all(result["embedding"] is None for result in results)
+
+
 def test_delete(test_db, weaviate_client, caplog):
     caplog.set_level(logging.DEBUG)
 
@@ -0,0 +1,118 @@
+import pytest
+
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentMetadataFilter,
+    QueryWithEmbedding,
+    Source,
+)
+
+
+@pytest.fixture
+def datastore(fake_datastore):
+    # one chunk in ten is written by Alice, one year apart each, and the scores follow their order
+    return fake_datastore(
+        chunks=[
+            DocumentChunk(
+                id=f"chunk-{i}",
+                text=f"Lorem ipsum {i}",
+                metadata=DocumentChunkMetadata(
+                    document_id=f"doc-{i // 10}",
+                    source=Source.email if i % 2 else Source.file,
+                    author="Alice" if i % 10 == 0 else "Bob",
+                    created_at=f"{1900 + i}-01-01T00:00:00Z",
+                ),
+                embedding=[1 - i / 1000],
+            )
+            for i in range(100)
+        ],
+        post_filter=True,
+    )
+
+
+def create_query(top_k: int, **filter) -> QueryWithEmbedding:
+    return QueryWithEmbedding(
+        query="query",
+        top_k=top_k,
+        embedding=[1.0],
+        filter=DocumentMetadataFilter(**filter) if filter else None,
+    )
+
+
+@pytest.mark.asyncio
+async def test_unfiltered_query_is_not_oversampled(datastore):
+    results = await datastore._query([create_query(3)])
+
+    assert [result.id for result in results[0].results] == [
+        "chunk-0",
+        "chunk-1",
+        "chunk-2",
+    ]
+    assert datastore.requested_top_ks == [[3]]
+
+
+@pytest.mark.asyncio
+async def test_oversampling_is_raised_until_top_k_matches(datastore):
+    results = await datastore._query([create_query(3), create_query(3, author="Alice")])
+
+    assert len(results[0].results) == 3
+    assert [result.id for result in results[1].results] == [
+        "chunk-0",
+        "chunk-10",
+        "chunk-20",
+    ]
+    # only the filtered query is requested again, with a wider top_k
+    assert datastore.requested_top_ks[0] == [3, 12]
+    assert all(len(top_ks) == 1 for top_ks in datastore.requested_top_ks[1:])
+    assert datastore.requested_top_ks[-1][0] > 12
+
+
+@pytest.mark.asyncio
+async def test_filters_on_dates_and_metadata(datastore):
+    results = await datastore._query(
+        [
+            create_query(
+                5,
+                source=Source.email,
+                start_date="1950-01-01",
+                end_date="1960-01-01T00:00:00Z",
+            )
+        ]
+    )
+
+    assert [result.id for result in results[0].results] == [
+        "chunk-51",
+        "chunk-53",
+        "chunk-55",
+        "chunk-57",
+        "chunk-59",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_returns_fewer_results_when_exhausted(datastore):
+    results = await datastore._query([create_query(5, document_id="doc-9")] * 2)
+
+    assert len(results) == 2
+    assert [result.id for result in results[0].results] == [
+        f"chunk-{i}" for i in range(90, 95)
+    ]
+
+    results = await datastore._query([create_query(20, document_id="doc-9")])
+
+    assert len(results[0].results) == 10
+
+
+@pytest.mark.asyncio
+async def test_stops_at_max_top_k(datastore, monkeypatch):
+    monkeypatch.setattr("datastore.datastore.POST_FILTER_MAX_TOP_K", 30)
+
+    results = await datastore._query([create_query(5, author="Alice")])
+
+    assert [result.id for result in results[0].results] == [
+        "chunk-0",
+        "chunk-10",
+        "chunk-20",
+    ]
+    assert datastore.requested_top_ks[-1] == [30]
@@ -0,0 +1,86 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from datastore.replicated_datastore import ReplicatedDataStore
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+
+@pytest.fixture
+def create_replica(fake_datastore):
+    def create(name: str, **kwargs):
+        # the replica answers with a chunk named after it
+        chunk = DocumentChunk(
+            id=name, text=name, metadata=DocumentChunkMetadata(), embedding=[1.0]
+        )
+        return fake_datastore(name=name, chunks=[chunk], **kwargs)
+
+    return create
+
+
+def answered_by(results: List[QueryResult]) -> str:
+    return results[0].results[0].id  # type: ignore
+
+
+QUERIES = [QueryWithEmbedding(query="query", embedding=[1.0])]
+
+
+@pytest.mark.asyncio
+async def test_writes_go_to_primary(create_replica):
+    primary = create_replica("primary")
+    replica = create_replica("replica")
+    datastore = ReplicatedDataStore(primary, [replica])
+
+    assert await datastore._upsert({"doc": []}) == ["doc"]
+    assert await datastore.delete(ids=["doc"])
+    assert answered_by(await datastore._query(QUERIES)) == "replica"
+
+    assert primary.calls == ["upsert", "delete"]
+    assert replica.calls == ["query"]
+
+
+@pytest.mark.asyncio
+async def test_prefers_fastest_replica(create_replica):
+    slow = create_replica("slow", delay=0.02)
+    fast = create_replica("fast", delay=0.001)
+    datastore = ReplicatedDataStore(create_replica("primary"), [slow, fast])
+
+    results = [answered_by(await datastore._query(QUERIES)) for _ in range(10)]
+
+    assert results[-5:] == ["fast"] * 5
+    assert len(slow.calls) < len(fast.calls)
+
+
+@pytest.mark.asyncio
+async def test_hedges_slow_replica(create_replica, monkeypatch):
+    monkeypatch.setattr("datastore.replicated_datastore.REPLICA_HEDGE_DELAY", 0.01)
+    stuck = create_replica("stuck", delay=10)
+    backup = create_replica("backup")
+    datastore = ReplicatedDataStore(create_replica("primary"), [stuck, backup])
+
+    results = await asyncio.wait_for(datastore._query(QUERIES), timeout=1)
+
+    assert answered_by(results) == "backup"
+    assert stuck.calls == ["query"]
+    await asyncio.sleep(0)
+    # the stuck query was cancelled and counted against the replica
+    assert datastore._stats[0].ewma > datastore._stats[1].ewma
+
+
+@pytest.mark.asyncio
+async def test_fails_over(create_replica):
+    down = create_replica("down", error=True)
+    up = create_replica("up")
+    datastore = ReplicatedDataStore(create_replica("primary"), [down, up])
+
+    assert answered_by(await datastore._query(QUERIES)) == "up"
+
+    up.error = True
+    with pytest.raises(RuntimeError):
+        await datastore._query(QUERIES)
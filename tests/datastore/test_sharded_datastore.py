@@ -0,0 +1,138 @@
+from typing import Dict, List
+
+import pytest
+
+from datastore.datastore import DataStore
+from datastore.sharded_datastore import ShardedDataStore
+from models.models import (
+    DEFAULT_TOP_K,
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentMetadataFilter,
+    QueryWithEmbedding,
+)
+
+
+@pytest.fixture
+def shards(fake_datastore) -> List[DataStore]:
+    return [fake_datastore() for _ in range(3)]
+
+
+@pytest.fixture
+def document_chunks() -> Dict[str, List[DocumentChunk]]:
+    return {
+        f"doc-{i}": [
+            DocumentChunk(
+                id=f"doc-{i}-chunk-{j}",
+                text=f"Lorem ipsum {i} {j}",
+                metadata=DocumentChunkMetadata(document_id=f"doc-{i}"),
+                embedding=[float(i), float(j)],
+            )
+            for j in range(2)
+        ]
+        for i in range(20)
+    }
+
+
+def owner(datastore: ShardedDataStore, document_id: str) -> DataStore:
+    return datastore.shards[datastore._get_shard_index(document_id)]
+
+
+@pytest.mark.asyncio
+async def test_upsert_routes_documents(shards, document_chunks):
+    datastore = ShardedDataStore(shards)
+
+    ids = await datastore._upsert(document_chunks)
+
+    assert sorted(ids) == sorted(document_chunks.keys())
+    assert all(shard.chunks for shard in shards)
+    for document_id, chunks in document_chunks.items():
+        for shard in shards:
+            assert (chunks[0].id in shard.chunks) == (
+                shard is owner(datastore, document_id)
+            )
+    # routing doesn't depend on the process
+    assert owner(ShardedDataStore(shards), "doc-0") is owner(datastore, "doc-0")
+
+
+@pytest.mark.asyncio
+async def test_query_merges_shards(shards, document_chunks):
+    datastore = ShardedDataStore(shards)
+    await datastore._upsert(document_chunks)
+
+    results = await datastore._query(
+        [
+            QueryWithEmbedding(query="a", embedding=[1.0, 0.0], top_k=3),
+            QueryWithEmbedding(
+                query="b",
+                embedding=[1.0, 1.0],
+                top_k=5,
+                filter=DocumentMetadataFilter(document_id="doc-4"),
+            ),
+        ]
+    )
+
+    assert [result.query for result in results] == ["a", "b"]
+    assert [result.metadata.document_id for result in results[0].results] == [
+        "doc-19",
+        "doc-19",
+        "doc-18",
+    ]
+    assert [result.id for result in results[1].results] == [
+        "doc-4-chunk-1",
+        "doc-4-chunk-0",
+    ]
+    # the filtered query only went to the owner of the document
+    assert [shard for shard in shards if "b" in shard.queries] == [
+        owner(datastore, "doc-4")
+    ]
+    assert all("a" in shard.queries for shard in shards)
+
+
+@pytest.mark.asyncio
+async def test_query_without_top_k(shards, document_chunks):
+    datastore = ShardedDataStore(shards)
+    await datastore._upsert(document_chunks)
+
+    results = await datastore._query(
+        [QueryWithEmbedding(query="a", embedding=[1.0, 0.0], top_k=None)]
+    )
+
+    assert len(results[0].results) == DEFAULT_TOP_K
+
+
+@pytest.mark.asyncio
+async def test_delete_routes_to_owner(shards, document_chunks):
+    datastore = ShardedDataStore(shards)
+    await datastore._upsert(document_chunks)
+
+    assert await datastore.delete(
+        filter=DocumentMetadataFilter(document_id="doc-1"), delete_all=False
+    )
+    assert [shard for shard in shards if shard.deletes] == [owner(datastore, "doc-1")]
+
+    assert await datastore.delete(ids=["doc-2", "doc-3"])
+    for document_id in ["doc-1", "doc-2", "doc-3"]:
+        assert f"{document_id}-chunk-0" not in owner(datastore, document_id).chunks
+    assert sum(len(shard.chunks) for shard in shards) == 34
+
+    assert await datastore.delete(delete_all=True)
+    assert not any(shard.chunks for shard in shards)
+
+
+@pytest.mark.asyncio
+async def test_delete_chunks_routes_to_owner(shards, document_chunks):
+    datastore = ShardedDataStore(shards)
+    await datastore._upsert(document_chunks)
+    chunk_ids = {
+        "doc-1": ["doc-1-chunk-1"],
+        "doc-2": ["doc-2-chunk-0", "doc-2-chunk-1"],
+    }
+
+    await datastore._delete_chunks(chunk_ids)
+
+    for document_id, ids in chunk_ids.items():
+        assert owner(datastore, document_id).deleted_chunks[document_id] == ids
+    # the other shards aren't asked, they might not support deleting chunks
+    assert sum(len(shard.deleted_chunks) for shard in shards) == 2
+    assert sum(len(shard.chunks) for shard in shards) == 37
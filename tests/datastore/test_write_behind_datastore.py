@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+from datastore.write_behind_datastore import WriteBehindDataStore
+from models.models import Document
+
+
+@pytest.fixture
+def log_path(tmp_path) -> str:
+    return str(tmp_path / "write_behind.jsonl")
+
+
+@pytest.mark.asyncio
+async def test_coalesces_upserts(fake_datastore, log_path):
+    datastore = fake_datastore()
+    write_behind = await WriteBehindDataStore.init(
+        datastore, log_path=log_path, window=60
+    )
+
+    await write_behind.upsert([Document(id="a", text="first")])
+    await write_behind.upsert([Document(id="b", text="other")])
+    ids = await write_behind.upsert(
+        [Document(id="a", text="second"), Document(text="new")]
+    )
+    assert ids[0] == "a" and ids[1]
+    assert datastore.upserts == []
+
+    await write_behind.close()
+
+    assert len(datastore.upserts) == 1
+    assert [(document.id, document.text) for document in datastore.upserts[0]] == [
+        ("a", "second"),
+        ("b", "other"),
+        (ids[1], "new"),
+    ]
+    with open(log_path) as f:
+        assert f.read() == ""
+
+
+@pytest.mark.asyncio
+async def test_replays_log(fake_datastore, log_path):
+    write_behind = await WriteBehindDataStore.init(
+        fake_datastore(), log_path=log_path, window=60
+    )
+    await write_behind.upsert([Document(id="a", text="first")])
+    await write_behind.upsert([Document(id="a", text="second")])
+    # the process dies while writing an entry
+    write_behind._flush_task.cancel()  # type: ignore
+    with open(log_path, "a") as f:
+        f.write('{"document": {"id": "b", "te')
+
+    datastore = fake_datastore()
+    write_behind = await WriteBehindDataStore.init(
+        datastore, log_path=log_path, window=60
+    )
+    await write_behind.close()
+
+    assert [(document.id, document.text) for document in datastore.upserts[0]] == [
+        ("a", "second")
+    ]
+
+
+@pytest.mark.asyncio
+async def test_flushes_full_batch(fake_datastore, log_path):
+    datastore = fake_datastore()
+    write_behind = await WriteBehindDataStore.init(
+        datastore, log_path=log_path, window=60, max_batch_size=2
+    )
+
+    await write_behind.upsert([Document(id="a", text="a")])
+    await asyncio.sleep(0.05)
+    assert datastore.upserts == []
+
+    await write_behind.upsert([Document(id="b", text="b")])
+    for _ in range(100):
+        if datastore.upserts:
+            break
+        await asyncio.sleep(0.01)
+
+    assert [document.id for document in datastore.upserts[0]] == ["a", "b"]
+    await write_behind.close()
+
+
+@pytest.mark.asyncio
+async def test_keeps_documents_when_flush_fails(fake_datastore, log_path):
+    datastore = fake_datastore()
+    write_behind = await WriteBehindDataStore.init(
+        datastore, log_path=log_path, window=60
+    )
+    await write_behind.upsert([Document(id="a", text="first")])
+
+    datastore.error = True
+    with pytest.raises(RuntimeError):
+        await write_behind.flush()
+    await write_behind.upsert([Document(id="b", text="other")])
+
+    datastore.error = False
+    await write_behind.close()
+
+    assert sorted(document.id for document in datastore.upserts[0]) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_failing_document(fake_datastore, log_path):
+    datastore = fake_datastore(failing_ids={"bad"})
+    write_behind = await WriteBehindDataStore.init(
+        datastore, log_path=log_path, window=60, max_attempts=2
+    )
+    await write_behind.upsert([Document(id="bad", text="bad")])
+    await write_behind.upsert([Document(id="good", text="good")], chunk_token_size=50)
+
+    with pytest.raises(RuntimeError):
+        await write_behind.flush()
+    # the other chunk size group is written, only the failed batch is kept
+    assert [[document.id for document in batch] for batch in datastore.upserts] == [
+        ["good"]
+    ]
+    with open(log_path) as f:
+        assert [json.loads(line)["document"]["id"] for line in f] == ["bad"]
+
+    with pytest.raises(RuntimeError):
+        await write_behind.flush()
+    with open(log_path) as f:
+        assert f.read() == ""
+    with open(f"{log_path}.dead") as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["document"]["id"] for entry in entries] == ["bad"]
+    assert entries[0]["error"] == "fake rejected the documents"
+
+    await write_behind.close()
+    assert len(datastore.upserts) == 1